@@ -0,0 +1,174 @@
+import io
+import logging
+import math
+import time
+from typing import List, Optional, Sequence, Tuple
+
+from PIL import Image, ImageChops
+
+from Objects.AssetCache import ASSET_CACHE
+from Objects.AvatarCache import fit_avatar
+from Objects.CardImage import CardImage, size_anchor
+from Objects.DesignImage import DesignImage
+from Objects.Encoder import encode_animated
+from Objects.RenderPlan import RenderPlan, Segment
+
+log = logging.getLogger(__name__)
+
+Box = Tuple[int, int, int, int]
+
+
+def is_animated(raw: bytes) -> bool:
+    """Whether avatar bytes are an animated GIF, WebP or APNG"""
+    try:
+        with Image.open(io.BytesIO(raw)) as image:
+            return getattr(image, "n_frames", 1) > 1
+    except Exception:
+        return False
+
+
+def frame_durations(source: Image.Image) -> List[int]:
+    durations = []
+    for n in range(source.n_frames):
+        source.seek(n)
+        source.load()
+        durations.append(source.info.get("duration") or 100)
+    return durations
+
+
+def overlay(card: CardImage, design: RenderPlan, segments) -> Image.Image:
+    """Composites segments onto transparency
+
+    Text drawn onto a transparent canvas keeps its straight colour while pasted images come out premultiplied, so the
+    segments are drawn over black and over white instead and the alpha is recovered from the difference. The result
+    is premultiplied throughout, like the static layers flatten expects.
+    """
+    black = card.compose(design, Image.new('RGBA', card.size, (0, 0, 0, 255)), segments)
+    white = card.compose(design, Image.new('RGBA', card.size, (255, 255, 255, 255)), segments)
+    black.putalpha(ImageChops.invert(ImageChops.difference(white, black).convert("L")))
+    return black
+
+
+class CardFrames(Image.Image):
+    """The frames of an animated card, composited one at a time as the encoder seeks to them
+
+    Every frame is drawn into the same card sized canvas: the static card is composited once, and each seek only
+    restores the avatar's box from it and pastes the next avatar frame and whatever the design layers above it.
+    """
+
+    def __init__(self, canvas: Image.Image, box: Box, region: Image.Image, top, source: Image.Image,
+                 bounds: Tuple[Optional[int], Optional[int]], mask: Optional[Image.Image], xy: Tuple[int, int],
+                 indices: Sequence[int]):
+        super().__init__()
+        self.im = canvas.im
+        self._mode = canvas.mode
+        self._size = canvas.size
+        self.canvas = canvas
+        self.box = box
+        self.region = region
+        self.top = top
+        self.source = source
+        self.bounds = bounds
+        self.mask = mask
+        self.xy = xy
+        self.indices = indices
+        self.frame = -1
+
+    @property
+    def n_frames(self) -> int:
+        return len(self.indices)
+
+    @property
+    def is_animated(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return max(self.frame, 0)
+
+    def seek(self, frame: int):
+        if not 0 <= frame < self.n_frames:
+            raise EOFError("no more frames in this card")
+        if frame == self.frame:
+            return
+
+        self.source.seek(self.indices[frame])
+        avatar, mask = fit_avatar(self.source.convert("RGBA"), self.bounds, self.mask)
+
+        region = self.region.copy()
+        region.paste(avatar, self.xy, mask)
+        image, top_mask, xy = self.top
+        if image is not None:
+            region.paste(image, xy, top_mask)
+        self.canvas.paste(region, self.box[:2])
+        self.frame = frame
+
+
+def render_animated(card: CardImage, design: RenderPlan) -> Optional[io.BytesIO]:
+    """Renders a card with an animated avatar, or returns None when the card should be static instead
+
+    Opted into with design.output["animated"], for example {"format": "webp", "max_frames": 48,
+    "max_bytes": 8388608}. Avatars with more than max_frames frames are decimated, and a card over max_bytes is
+    retried with half as many frames a few times before falling back to the static card.
+    """
+    options = design.output["animated"]
+    raw = card.mem['AVATAR']
+    if not is_animated(raw):
+        return None
+
+    # only a top level avatar has a fixed box, inside a group its position depends on what else is shown
+    pfp = next((i for i in design.items if isinstance(i, DesignImage) and i.image == "PFP" and card.perm_check(i)),
+               None)
+    if pfp is None:
+        return None
+
+    k = next(n for n, s in enumerate(design.segments) if pfp in s.items)
+    j = design.segments[k].items.index(pfp)
+    below = [*enumerate(design.segments[:k]), (k, Segment(False, design.segments[k].items[:j], 0))]
+    above = [(k, Segment(False, design.segments[k].items[j + 1:], 0)), *enumerate(design.segments[k + 1:], k + 1)]
+
+    base = card.compose(design, None, below) or Image.new('RGBA', card.size, card.bg)
+    top = overlay(card, design, above)
+
+    source = Image.open(io.BytesIO(raw))
+    bounds = card.bounds(pfp)
+    mask = ASSET_CACHE.get_mask(design.path(pfp.mask), design.version, card.scale) if pfp.mask else None
+    size = fit_avatar(source.convert("RGBA"), bounds, mask)[0].size
+    x, y = size_anchor(card.at(pfp.pos), size, pfp.anchor)
+    box = (max(x, 0), max(y, 0), min(x + size[0], card.size[0]), min(y + size[1], card.size[1]))
+    if box[0] >= box[2] or box[1] >= box[3]:
+        return None
+
+    canvas = base.copy()
+    image, top_mask, top_xy = card.flatten(top)
+    if image is not None:
+        canvas.paste(image, top_xy, top_mask)
+    region = base.crop(box)
+    top = card.flatten(top.crop(box))
+    xy = (x - box[0], y - box[1])
+
+    durations = frame_durations(source)
+    count = len(durations)
+    step = max(1, math.ceil(count / options.get("max_frames", 48)))
+    max_bytes = options.get("max_bytes", 8 * 1024 * 1024)
+
+    for _ in range(4):
+        indices = range(0, count, step)
+        # a kept frame lasts as long as the frames dropped after it, browsers slow down anything under 20ms
+        kept = [max(20, sum(durations[n:n + step])) for n in indices]
+        frames = CardFrames(canvas, box, region, top, source, bounds, mask, xy, indices)
+
+        if card.stages is not None:
+            stage_start = time.perf_counter()
+        buffer = encode_animated(frames, kept, options)
+        if card.stages is not None:
+            card.record("encode", stage_start)
+
+        if buffer.getbuffer().nbytes <= max_bytes:
+            return buffer
+        if len(indices) == 1:
+            break
+        step *= 2
+
+    log.info("Animated %s card is over %d bytes at %d frames, sending a static card", design.name, max_bytes,
+             len(indices))
+    return None
@@ -0,0 +1,241 @@
+import io
+import threading
+import time
+from typing import Iterator, Tuple
+
+import numpy as np
+from PIL import Image, ImageColor, ImageDraw
+
+from Objects.AssetCache import ASSET_CACHE
+from Objects.AvatarCache import AVATAR_CACHE, decode_avatar
+from Objects.CardImage import CardImage, LAYER_CACHE, size_anchor, text_anchor
+from Objects.DesignImage import DesignImage
+from Objects.DesignText import DesignText
+from Objects.Encoder import encode
+from Objects.RenderPlan import RenderPlan
+from Objects.TextLayout import fit_text
+
+# (premultiplied array, top left corner, fully opaque) for each separate part of a static layer
+Layer = Tuple[Tuple[np.ndarray, Tuple[int, int], bool], ...]
+
+# card buffers are reused between renders on the same thread
+_buffers = threading.local()
+
+
+def buffer(size: Tuple[int, int]) -> np.ndarray:
+    card = getattr(_buffers, "card", None)
+    if card is None or card.shape[:2] != (size[1], size[0]):
+        card = _buffers.card = np.empty((size[1], size[0], 4), np.uint8)
+    return card
+
+
+def premultiply(image: Image.Image, mask: Image.Image) -> np.ndarray:
+    """RGBA array with the colour channels of image premultiplied by mask"""
+    alpha = np.asarray(mask, np.uint16)[..., None]
+    array = np.empty((image.size[1], image.size[0], 4), np.uint8)
+    array[..., :3] = (np.asarray(image.convert("RGB"), np.uint16) * alpha + 127) // 255
+    array[..., 3] = alpha[..., 0]
+    return array
+
+
+def over(dst: np.ndarray, src: np.ndarray, xy: Tuple[int, int], opaque: bool = False):
+    """Blends premultiplied src over dst in place with its top left corner at xy, clipped to dst
+
+    Opaque sources, and anything pasted onto a blank card, are copied instead.
+    """
+    x, y = xy
+    h, w = src.shape[:2]
+    x0, y0, x1, y1 = max(x, 0), max(y, 0), min(x + w, dst.shape[1]), min(y + h, dst.shape[0])
+    if x0 >= x1 or y0 >= y1:
+        return
+
+    s = src[y0 - y:y1 - y, x0 - x:x1 - x]
+    d = dst[y0:y1, x0:x1]
+    if opaque:
+        d[...] = s
+        return
+
+    # d * (255 - alpha) / 255, rounded, without leaving 16 bit integers
+    t = d * (255 - s[..., 3:4]).astype(np.uint16)
+    t += 128
+    t += t >> 8
+    t >>= 8
+    t += s
+    d[...] = t
+
+
+def tint(dst: np.ndarray, alpha: np.ndarray, color: Tuple[int, int, int], xy: Tuple[int, int]):
+    """Blends a solid colour over dst in place through a 16 bit alpha mask, clipped to dst"""
+    x, y = xy
+    h, w = alpha.shape
+    x0, y0, x1, y1 = max(x, 0), max(y, 0), min(x + w, dst.shape[1]), min(y + h, dst.shape[0])
+    if x0 >= x1 or y0 >= y1:
+        return
+
+    a = alpha[y0 - y:y1 - y, x0 - x:x1 - x, None]
+    d = dst[y0:y1, x0:x1]
+
+    # (d * (255 - a) + ink * a) / 255, with ink the colour plus full alpha
+    t = d * (255 - a)
+    t += a * np.array((*color, 255), np.uint16)
+    t += 128
+    t += t >> 8
+    t >>= 8
+    d[...] = t
+
+
+def runs(classes: np.ndarray) -> Iterator[Tuple[int, int, int]]:
+    """(class, start, end) of every run of equal values in a 1D array"""
+    edges = np.flatnonzero(np.diff(classes)) + 1
+    starts = [0] + edges.tolist()
+    ends = edges.tolist() + [len(classes)]
+    for start, end in zip(starts, ends):
+        yield int(classes[start]), start, end
+
+
+def cut(alpha: np.ndarray, x: int = 0, y: int = 0, axis: int = 0,
+        depth: int = 4) -> Iterator[Tuple[int, int, int, int, bool]]:
+    """Boxes covering a layer, alternately cut into rows and columns that are empty, opaque or mixed
+
+    Yields (x0, y0, x1, y1, opaque). Empty runs are dropped, so a layer of separate badges becomes one box per badge
+    and a card base with a hole for the avatar becomes opaque bands to copy around a small box to blend.
+    """
+    lines = alpha if axis == 0 else alpha.T
+    classes = np.where(lines.max(1) == 0, 0, np.where(lines.min(1) == 255, 2, 1))
+    for cls, start, end in runs(classes):
+        if cls == 0:
+            continue
+        if axis == 0:
+            box, sub, sx, sy = (x, y + start, x + alpha.shape[1], y + end), alpha[start:end], x, y + start
+        else:
+            box, sub, sx, sy = (x + start, y, x + end, y + alpha.shape[0]), alpha[:, start:end], x + start, y
+
+        if cls == 2:
+            yield (*box, True)
+        elif depth and sub.shape != alpha.shape:
+            yield from cut(sub, sx, sy, 1 - axis, depth - 1)
+        elif depth and axis == 0:
+            # a single mixed band can still be cut into columns
+            yield from cut(sub, sx, sy, 1, depth - 1)
+        else:
+            yield (*box, False)
+
+
+def pieces(canvas: np.ndarray) -> Layer:
+    """Splits a composited layer into the parts that cover something, noting which are fully opaque"""
+    return tuple((canvas[y0:y1, x0:x1].copy(), (x0, y0), opaque) for x0, y0, x1, y1, opaque in cut(canvas[..., 3]))
+
+
+class ArrayCardImage(CardImage):
+    """CardImage that composites into a premultiplied RGBA NumPy buffer
+
+    Assets, avatars and static layers are cached as premultiplied arrays and blended in place, and the buffer is
+    converted to an Image once, for encoding. Opaque pixels match the PIL path to within 1, partly transparent ones
+    on antialiased edges don't, since blending premultiplied values rounds differently.
+    """
+
+    def frame_card(self) -> CardImage:
+        return CardImage(self.mem, stages=self.stages)
+
+    def still(self, design: RenderPlan) -> io.BytesIO:
+        card = buffer(self.size)
+        card.fill(0)
+        blank = True
+        for n, segment in enumerate(design.segments):
+            if not segment.static:
+                for i in segment.items:
+                    if self.perm_check(i):
+                        self.paste_object(card, None, design, i)
+                blank = False
+                continue
+
+            if self.stages is not None:
+                stage_start = time.perf_counter()
+
+            key = (design.name, design.version, n, self.bits & segment.role_mask, self.scale, "array")
+            layer = LAYER_CACHE.get(key)
+            if layer is None:
+                layer = pieces(self.composite(design, segment.items))
+                LAYER_CACHE.put(key, layer, sum(array.nbytes for array, _, _ in layer))
+            for array, xy, opaque in layer:
+                # the pieces of a layer don't overlap, so on a blank card each one can be copied
+                over(card, array, xy, opaque or blank)
+            blank = False
+
+            if self.stages is not None:
+                self.record("layers", stage_start)
+
+        if self.stages is not None:
+            stage_start = time.perf_counter()
+        image = Image.frombuffer("RGBA", self.size, card, "raw", "RGBa", 0, 1)
+        image_file_object = encode(image, design.output)
+        if self.stages is not None:
+            self.record("encode", stage_start)
+
+        return image_file_object
+
+    def composite(self, design: RenderPlan, items):
+        stages, self.stages = self.stages, None
+
+        canvas = np.zeros((self.size[1], self.size[0], 4), np.uint8)
+        for i in items:
+            if self.perm_check(i):
+                self.paste_object(canvas, None, design, i)
+
+        self.stages = stages
+        return canvas
+
+    def paste_text(self, card: np.ndarray, draw: None, design: RenderPlan, i: DesignText, pos: Tuple[int, int],
+                   anchor: str):
+        text = i.text.format(**self.mem)
+        font = design.get_font(i.font, self.font_size(fit_text(design, i, text)))
+        anchor = text_anchor(anchor)
+        pos = self.at(pos)
+
+        left, top, right, bottom = font.getbbox(text, anchor=anchor)
+        if right <= left or bottom <= top:
+            return
+        coverage = Image.new("L", (right - left, bottom - top))
+        ImageDraw.Draw(coverage).text((-left, -top), text, font=font, fill=255, anchor=anchor)
+
+        color = ImageColor.getrgb(i.color) if isinstance(i.color, str) else tuple(int(c) for c in i.color)
+        alpha = np.asarray(coverage, np.uint16)
+        if len(color) == 4:
+            alpha = (alpha * color[3] + 127) // 255
+        tint(card, alpha, color[:3], (round(pos[0]) + left, round(pos[1]) + top))
+
+    def paste_image(self, card: np.ndarray, design: RenderPlan, i: DesignImage, pos: Tuple[int, int], anchor: str):
+        if i.image == "PFP":
+            if not self.mem['AVATAR']:
+                return
+            array = self.avatar_array(design, i)
+        else:
+            array = asset_array(design, i, self.scale)
+
+        over(card, array, size_anchor(self.at(pos), (array.shape[1], array.shape[0]), anchor))
+
+    def avatar_array(self, design: RenderPlan, i: DesignImage) -> np.ndarray:
+        bounds = self.bounds(i)
+        key = self.mem.get('AVATAR_KEY')
+        ckey = ("array", key, bounds, (design.version, i.mask) if i.mask else None)
+        array = AVATAR_CACHE.get(ckey) if key is not None else None
+        if array is None:
+            mask = ASSET_CACHE.get_mask(design.path(i.mask), design.version, self.scale) if i.mask else None
+            array = premultiply(*decode_avatar(self.mem['AVATAR'], bounds, mask))
+            if key is not None:
+                AVATAR_CACHE.put(ckey, array, array.nbytes)
+        return array
+
+
+def asset_array(design: RenderPlan, i: DesignImage, scale: float = 1.0) -> np.ndarray:
+    bounds = (i.max_width, i.max_height)
+    path = design.path(i)
+    key = (path, bounds, ("array", i.mask, scale), design.version)
+    array = ASSET_CACHE.get(key)
+    if array is None:
+        image, mask = ASSET_CACHE.get_image(path, bounds, version=design.version, scale=scale)
+        if i.mask:
+            mask = ASSET_CACHE.get_mask(design.path(i.mask), design.version, scale)
+        array = premultiply(image, mask)
+        ASSET_CACHE.put(key, array, array.nbytes)
+    return array
@@ -0,0 +1,123 @@
+from typing import Dict, Iterable, Optional, Tuple
+
+from PIL import Image
+
+from Objects.LRUCache import LRUCache
+
+
+def fit_size(size: Tuple[int, int], max_width: Optional[int], max_height: Optional[int]) -> Tuple[int, int]:
+    if not (max_width or max_height):
+        return size
+
+    if max_width and max_width < size[0]:
+        size = (max_width, size[1] * max_width / size[0])
+    if max_height and max_height < size[1]:
+        size = (size[0] * max_height / size[1], max_height)
+    return round(size[0]), round(size[1])
+
+
+def scale_size(size: Tuple[int, int], scale: float) -> Tuple[int, int]:
+    return max(1, round(size[0] * scale)), max(1, round(size[1] * scale))
+
+
+def image_bytes(image: Image.Image) -> int:
+    return image.size[0] * image.size[1] * len(image.getbands())
+
+
+class AssetCache(LRUCache):
+    """Decoded design assets keyed by (path, bounding size, mode, design version)
+
+    Cards rendered below full size use a pyramid of the same assets, each scale resized once from the full size
+    asset and cached under its own (mode, scale). Keeping the design version in the key lets renders of a plan that
+    is being replaced keep their assets while the new version decodes its own. Assets mapped from a design bundle
+    are returned as they are and never evicted.
+    """
+
+    def __init__(self, max_bytes: int, **kwargs):
+        super().__init__(max_bytes, **kwargs)
+        # (path, bounds, version) -> (image, mask), bounds None for masks
+        self.mapped: Dict[Tuple, Tuple[Image.Image, Optional[Image.Image]]] = {}
+
+    def map(self, version: str, images: Iterable[Tuple[str, Tuple, Image.Image, Image.Image]],
+            masks: Iterable[Tuple[str, Image.Image]]):
+        """Serves already decoded (path, bounds, image, mask) images and (path, mask) masks for a design version"""
+        for path, bounds, image, mask in images:
+            self.mapped[(path, bounds, version)] = (image, mask)
+        for path, mask in masks:
+            self.mapped[(path, None, version)] = (mask, None)
+
+    def get_image(self, path: str, bounds: Tuple[Optional[int], Optional[int]] = (None, None),
+                  mode: str = "RGB", version: Optional[str] = None,
+                  scale: float = 1.0) -> Tuple[Image.Image, Image.Image]:
+        """Returns the asset fitted into bounds and converted to mode, along with its alpha mask"""
+        if scale != 1:
+            key = (path, bounds, (mode, scale), version)
+            cached = self.get(key)
+            if cached is None:
+                image, mask = self.get_image(path, bounds, mode, version)
+                # resized with its alpha so hidden colours don't bleed into the edges
+                image = image.convert("RGB").convert("RGBA")
+                image.putalpha(mask)
+                image = image.resize(scale_size(image.size, scale))
+                mask = image.getchannel("A")
+                if mode != "RGBA":
+                    image = image.convert(mode)
+
+                cached = (image, mask)
+                self.put(key, cached, image_bytes(image) + image_bytes(mask))
+            return cached
+
+        mapped = self.mapped.get((path, bounds, version))
+        if mapped is not None and mode in ("RGB", "RGBA"):
+            # opaque RGBA, which pastes through its mask the same as RGB
+            return mapped
+
+        key = (path, bounds, mode, version)
+        cached = self.get(key)
+        if cached is None:
+            with Image.open(path) as src:
+                image = src.convert("RGBA")
+
+            size = fit_size(image.size, *bounds)
+            if size != image.size:
+                image = image.resize(size)
+
+            mask = image.getchannel("A")
+            if mode != "RGBA":
+                image = image.convert(mode)
+
+            cached = (image, mask)
+            self.put(key, cached, image_bytes(image) + image_bytes(mask))
+        return cached
+
+    def get_mask(self, path: str, version: Optional[str] = None, scale: float = 1.0) -> Image.Image:
+        """Returns the alpha channel of a mask asset"""
+        if scale != 1:
+            key = (path, None, ("A", scale), version)
+            mask = self.get(key)
+            if mask is None:
+                mask = self.get_mask(path, version)
+                mask = mask.resize(scale_size(mask.size, scale))
+                self.put(key, mask, image_bytes(mask))
+            return mask
+
+        mapped = self.mapped.get((path, None, version))
+        if mapped is not None:
+            return mapped[0]
+
+        key = (path, None, "A", version)
+        mask = self.get(key)
+        if mask is None:
+            with Image.open(path) as src:
+                mask = src.convert("RGBA").getchannel("A")
+            self.put(key, mask, image_bytes(mask))
+        return mask
+
+    def retire(self, version: str):
+        """Drops the assets decoded for a design version that is no longer live"""
+        self.discard_where(lambda k: k[3] == version)
+        for key in [k for k in self.mapped if k[2] == version]:
+            del self.mapped[key]
+
+
+ASSET_CACHE = AssetCache(256 * 1024 * 1024)
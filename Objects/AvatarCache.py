@@ -0,0 +1,131 @@
+import asyncio
+import io
+import mmap
+import struct
+from typing import Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+from PIL import Image
+
+from Objects.AssetCache import fit_size, image_bytes
+from Objects.DiskCache import DiskCache
+from Objects.LRUCache import LRUCache
+
+# width, height and whether the avatar's own mask follows its pixels, padded to 64 bytes
+AVATAR_HEADER = struct.Struct("<IIB")
+
+
+def decode_avatar(raw: bytes, bounds: Tuple[Optional[int], Optional[int]],
+                  mask: Optional[Image.Image] = None) -> Tuple[Image.Image, Image.Image]:
+    """Decodes an avatar, scales it to fit bounds and returns it with the mask to paste it through"""
+    return fit_avatar(Image.open(io.BytesIO(raw)), bounds, mask)
+
+
+def fit_avatar(image: Image.Image, bounds: Tuple[Optional[int], Optional[int]],
+               mask: Optional[Image.Image] = None) -> Tuple[Image.Image, Image.Image]:
+    """Scales a decoded avatar, or one frame of an animated one, to fit bounds"""
+    maxsize = max(m if m else 0 for m in bounds)
+    if image.size[0] < maxsize:
+        image = image.resize((maxsize, maxsize))
+
+    image = image.convert("RGBA")
+    size = fit_size(image.size, *bounds)
+    if size != image.size:
+        image = image.resize(size)
+
+    if mask is None:
+        mask = image.getchannel("A")
+    return image.convert("RGB"), mask
+
+
+def pack_avatar(image: Image.Image, mask: Optional[Image.Image]) -> bytes:
+    """A decoded avatar as opaque RGBA pixels, which are read back without decoding, and its own mask"""
+    header = AVATAR_HEADER.pack(*image.size, mask is not None).ljust(64, b"\0")
+    return header + image.convert("RGBA").tobytes() + (mask.tobytes() if mask is not None else b"")
+
+
+def unpack_avatar(data: mmap.mmap) -> Tuple[Image.Image, Optional[Image.Image]]:
+    """Copies a packed avatar out of a mapping, so the mapping and the file it holds open can be closed"""
+    width, height, own_mask = AVATAR_HEADER.unpack_from(data)
+    end = 64 + width * height * 4
+    with memoryview(data) as view:
+        image = Image.frombytes("RGBA", (width, height), view[64:end])
+        mask = Image.frombytes("L", (width, height), view[end:end + width * height]) if own_mask else None
+    return image, mask
+
+
+class AvatarCache(LRUCache):
+    """Avatars keyed by Discord asset hash, both as downloaded bytes and decoded for a PFP slot
+
+    When disk is set, both are also kept there, so they survive restarts and are shared with render processes. fetch
+    reads and writes it in a thread, off the event loop.
+    """
+
+    def __init__(self, max_bytes: int, **kwargs):
+        super().__init__(max_bytes, **kwargs)
+        self.disk: Optional[DiskCache] = None
+        self.inflight: Dict[str, asyncio.Future] = {}
+        self.fetches: int = 0
+        self.coalesced: int = 0
+
+    async def fetch(self, key: str, read: Callable[[], Awaitable[bytes]]) -> bytes:
+        """Returns the avatar bytes, concurrent calls for the same key share a single read()"""
+        data = self.get(("raw", key))
+        if data is not None:
+            return data
+
+        future = self.inflight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self.inflight[key] = future
+        try:
+            if self.disk is not None:
+                data = await asyncio.to_thread(self.disk.get, "avatar", key)
+            if data is None:
+                data = await read()
+                self.fetches += 1
+                if self.disk is not None:
+                    await asyncio.to_thread(self.disk.put, "avatar", key, data)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # waiters re-raise it, don't warn if there are none
+            raise
+        else:
+            self.put(("raw", key), data, len(data))
+            future.set_result(data)
+            return data
+        finally:
+            del self.inflight[key]
+
+    def decode(self, key: Optional[str], raw: bytes, bounds: Tuple[Optional[int], Optional[int]],
+               mask: Optional[Image.Image] = None, mask_key: Hashable = None) -> Tuple[Image.Image, Image.Image]:
+        if key is None:
+            return decode_avatar(raw, bounds, mask)
+
+        ckey = ("image", key, bounds, mask_key)
+        cached = self.get(ckey)
+        if cached is None:
+            mapped = self.disk.map("avatar-image", ckey) if self.disk is not None else None
+            if mapped is not None:
+                with mapped:
+                    image, own_mask = unpack_avatar(mapped)
+                cached = (image, own_mask if own_mask is not None else mask)
+            else:
+                cached = decode_avatar(raw, bounds, mask)
+                if self.disk is not None:
+                    self.disk.put("avatar-image", ckey, pack_avatar(cached[0], None if mask else cached[1]))
+            self.put(ckey, cached, image_bytes(cached[0]) + (0 if mask else image_bytes(cached[1])))
+        return cached
+
+    def stats(self) -> Dict[str, int]:
+        stats = super().stats()
+        stats.update(fetches=self.fetches, coalesced=self.coalesced, inflight=len(self.inflight))
+        return stats
+
+
+AVATAR_CACHE = AvatarCache(128 * 1024 * 1024)
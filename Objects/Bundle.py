@@ -0,0 +1,192 @@
+import hashlib
+import json
+import logging
+import mmap
+import os
+import pickle
+import struct
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+from PIL import Image
+
+from Designs import key as role_key
+from Objects.AssetCache import fit_size
+from Objects.Design import Design, load_design_from_json
+from Objects.DesignImage import DesignImage
+
+MAGIC = b"PBBNDL01"
+ALIGN = 64
+
+# role bits in a pickled design are numbered in the order of this file's keys, so it is a source of every bundle
+ROLE_KEY_SOURCE = os.path.relpath(role_key.__file__)
+
+log = logging.getLogger(__name__)
+
+Bounds = Tuple[Optional[int], Optional[int]]
+
+
+def bundle_path(file_path: str) -> str:
+    """Designs/default.json is bundled as Designs/default.bundle"""
+    return os.path.splitext(file_path)[0] + ".bundle"
+
+
+def digest(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def source_stamp(path: str) -> List[Any]:
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns, digest(path)]
+
+
+class BundleWriter:
+    """Writes 64 byte aligned blobs after the header, then the JSON index at the end"""
+
+    def __init__(self, f: BinaryIO):
+        self.f = f
+        self.f.write(MAGIC + struct.pack("<QQ", 0, 0))
+
+    def add(self, data: bytes) -> List[int]:
+        self.f.write(b"\0" * (-self.f.tell() % ALIGN))
+        span = [self.f.tell(), len(data)]
+        self.f.write(data)
+        return span
+
+    def finish(self, index: Dict[str, Any]):
+        data = json.dumps(index).encode()
+        offset = self.f.tell()
+        self.f.write(data)
+        self.f.seek(len(MAGIC))
+        self.f.write(struct.pack("<QQ", offset, len(data)))
+
+
+def build_bundle(file_path: str, trail: Optional[str] = None, out_path: Optional[str] = None) -> str:
+    """Compiles a design and decodes its assets into a bundle next to the JSON, returns the bundle's path
+
+    Images are stored at the size each image object fits them to, as opaque RGBA plus a separate alpha mask, which
+    is what the asset cache would have decoded them into.
+    """
+    out_path = out_path or bundle_path(file_path)
+    design = load_design_from_json(file_path, trail)
+
+    images: Dict[Tuple[str, Bounds], None] = {}
+    masks: Dict[str, None] = {}
+    stack = list(design.items)
+    while stack:
+        i = stack.pop()
+        stack.extend(getattr(i, "contents", []))
+        if isinstance(i, DesignImage):
+            if i.image != "PFP":
+                images[(design.path(i), (i.max_width, i.max_height))] = None
+            if i.mask:
+                masks[design.path(i.mask)] = None
+    fonts = {name: design.path(p) for name, p in design.font_paths.items()}
+
+    sources = [file_path, ROLE_KEY_SOURCE] + sorted({p for p, _ in images} | set(masks) | set(fonts.values()))
+    index: Dict[str, Any] = {
+        "name": design.name,
+        "sources": {p: source_stamp(p) for p in sources},
+        "images": [],
+        "masks": [],
+        "fonts": {}
+    }
+
+    tmp = f"{out_path}.tmp"
+    with open(tmp, "wb") as f:
+        writer = BundleWriter(f)
+        index["design"] = writer.add(pickle.dumps(design, protocol=pickle.HIGHEST_PROTOCOL))
+
+        for path, bounds in images:
+            with Image.open(path) as src:
+                image = src.convert("RGBA")
+            size = fit_size(image.size, *bounds)
+            if size != image.size:
+                image = image.resize(size)
+            mask = image.getchannel("A")
+            image.putalpha(255)
+            index["images"].append({"path": path, "bounds": list(bounds), "size": list(size),
+                                    "rgb": writer.add(image.tobytes()), "mask": writer.add(mask.tobytes())})
+
+        for path in masks:
+            with Image.open(path) as src:
+                mask = src.convert("RGBA").getchannel("A")
+            index["masks"].append({"path": path, "size": list(mask.size), "data": writer.add(mask.tobytes())})
+
+        for name, path in fonts.items():
+            with open(path, "rb") as font:
+                index["fonts"][name] = writer.add(font.read())
+
+        writer.finish(index)
+    os.replace(tmp, out_path)
+    return out_path
+
+
+class Bundle:
+    """A design built by bundle.py, opened with mmap
+
+    Image and mask pixels are used straight from the mapping, so they are never decoded and every process that opens
+    the same bundle shares one copy of them through the page cache.
+    """
+
+    def __init__(self, path: str):
+        self.path: str = path
+        with open(path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.map[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a design bundle")
+        offset, length = struct.unpack_from("<QQ", self.map, len(MAGIC))
+        self.index: Dict[str, Any] = json.loads(self.map[offset:offset + length])
+
+        sources = self.index["sources"]
+        self.version: str = hashlib.sha1(
+            "".join(f"{p}:{sources[p][2]}" for p in sorted(sources)).encode()
+        ).hexdigest()
+
+    def blob(self, span: List[int]) -> memoryview:
+        offset, length = span
+        return memoryview(self.map)[offset:offset + length]
+
+    def fresh(self) -> bool:
+        """Whether every source file still matches what was bundled, rehashing only files whose stat changed"""
+        if ROLE_KEY_SOURCE not in self.index["sources"]:
+            # built before the role keys were a source, its role bits can't be trusted
+            return False
+        for path, (size, mtime, sha) in self.index["sources"].items():
+            try:
+                st = os.stat(path)
+            except OSError:
+                return False
+            if (st.st_size, st.st_mtime_ns) != (size, mtime) and (st.st_size != size or digest(path) != sha):
+                return False
+        return True
+
+    def design(self) -> Design:
+        design: Design = pickle.loads(self.blob(self.index["design"]))
+        design.font_data = {name: self.blob(span) for name, span in self.index["fonts"].items()}
+        return design
+
+    def images(self) -> Iterator[Tuple[str, Bounds, Image.Image, Image.Image]]:
+        """(path, bounds, opaque RGBA image, alpha mask) for every fitted image"""
+        for e in self.index["images"]:
+            size = tuple(e["size"])
+            image = Image.frombuffer("RGBA", size, self.blob(e["rgb"]), "raw", "RGBA", 0, 1)
+            mask = Image.frombuffer("L", size, self.blob(e["mask"]), "raw", "L", 0, 1)
+            yield e["path"], tuple(e["bounds"]), image, mask
+
+    def masks(self) -> Iterator[Tuple[str, Image.Image]]:
+        for e in self.index["masks"]:
+            yield e["path"], Image.frombuffer("L", tuple(e["size"]), self.blob(e["data"]), "raw", "L", 0, 1)
+
+
+def open_bundle(file_path: str) -> Optional[Bundle]:
+    """The bundle built from a design JSON, None when there isn't one or its sources have changed since"""
+    path = bundle_path(file_path)
+    if not os.path.exists(path):
+        return None
+    bundle = Bundle(path)
+    if not bundle.fresh():
+        log.warning("%s is older than the files it was built from, loading %s instead", path, file_path)
+        return None
+    return bundle
+
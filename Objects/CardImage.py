@@ -0,0 +1,297 @@
+import io
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterable, Optional, Tuple, Type
+
+from PIL import Image, ImageDraw
+
+from Objects.AssetCache import ASSET_CACHE, image_bytes, scale_size
+from Objects.AvatarCache import AVATAR_CACHE
+from Objects.DesignGroup import DesignGroup
+from Objects.DesignImage import DesignImage
+from Objects.DesignObj import DesignObj
+from Objects.DesignText import DesignText
+from Objects.Encoder import encode
+from Objects.LRUCache import LRUCache
+from Objects.RenderPlan import RenderPlan, Segment, walk
+from Objects.RoleBits import info_bits
+from Objects.TextLayout import fit_text
+
+# composited static segments, keyed by design version, segment, visible roles and scale
+LAYER_CACHE = LRUCache(64 * 1024 * 1024)
+
+# design coordinates are in pixels of a full size card
+REFERENCE_SIZE = (1280, 833)
+MIN_WIDTH, MAX_WIDTH = 64, 2560
+
+# card widths /profile can ask for
+SIZES = {"full": 1280, "embed": 640, "thumbnail": 256}
+
+
+def card_scale(width: Optional[int] = None) -> float:
+    """Scale from design coordinates to a card width in pixels, full size when width is None"""
+    if width is None:
+        return 1.0
+    if not isinstance(width, int) or not MIN_WIDTH <= width <= MAX_WIDTH:
+        raise ValueError(f"Card width must be a whole number of pixels from {MIN_WIDTH} to {MAX_WIDTH}")
+    return width / REFERENCE_SIZE[0]
+
+
+def size_anchor(pos, size, anchor):
+    px, py = pos
+    sx, sy = size
+
+    if "R" in anchor:
+        px -= sx
+    elif "L" not in anchor:
+        px -= sx / 2
+
+    if any(i in anchor for i in ["D", "B"]):
+        py -= sy
+    elif all(i not in anchor for i in ["T", "U"]):
+        py -= sy / 2
+
+    return round(px), round(py)
+
+
+def text_anchor(anchor):
+    parts = list(anchor)
+    new = []
+
+    if "L" in parts:
+        new.append("l")
+    elif "R" in parts:
+        new.append("r")
+    else:
+        new.append("m")
+
+    if any(i in parts for i in ["U", "T"]):
+        new.append("a")
+    elif any(i in parts for i in ["D", "B"]):
+        new.append("d")
+    else:
+        new.append("m")
+
+    return "".join(new)
+
+
+class CardImage:
+    def __init__(self, mem: Optional[Dict[str, Any]] = None, *, stages: Optional[Dict[str, float]] = None):
+        # mem["WIDTH"] renders the card smaller or larger than the design's own size
+        self.scale = card_scale(mem.get("WIDTH") if mem else None)
+        self.size = scale_size(REFERENCE_SIZE, self.scale)
+        self.bg = (0, 0, 0, 0)
+        self.mem = mem
+
+        # when given, seconds spent per render stage ("perm", "text", "image", "group", "layers", "encode")
+        # are added to it
+        self.stages = stages
+
+        if stages is not None:
+            stage_start = time.perf_counter()
+        self.bits = info_bits(mem) if mem else 0
+        if stages is not None:
+            self.record("perm", stage_start)
+
+    def record(self, stage: str, start: float):
+        self.stages[stage] = self.stages.get(stage, 0.0) + time.perf_counter() - start
+
+    def at(self, pos: Tuple[float, float]) -> Tuple[float, float]:
+        """A position in design coordinates on this card"""
+        if self.scale == 1:
+            return pos
+        return pos[0] * self.scale, pos[1] * self.scale
+
+    def bounds(self, i: DesignObj) -> Tuple[Optional[int], Optional[int]]:
+        """Size an avatar is fitted into on this card"""
+        if self.scale == 1:
+            return i.max_width, i.max_height
+        return tuple(round(b * self.scale) if b else b for b in (i.max_width, i.max_height))
+
+    def font_size(self, size: int) -> int:
+        return size if self.scale == 1 else max(1, round(size * self.scale))
+
+    def imager(self, design: RenderPlan, *, timer=False):
+        if timer:
+            start = datetime.now()
+
+        image_file_object = None
+        if design.output.get("animated") and self.mem and self.mem['AVATAR']:
+            from Objects.AnimatedCard import render_animated
+            image_file_object = render_animated(self.frame_card(), design)
+        if image_file_object is None:
+            image_file_object = self.still(design)
+
+        if timer:
+            print(f"{round((datetime.now() - start).total_seconds(), 2)}s")
+
+        return image_file_object
+
+    def frame_card(self) -> "CardImage":
+        """The card animated frames are composited with, they are built from PIL images"""
+        return self
+
+    def still(self, design: RenderPlan) -> io.BytesIO:
+        """Composites and encodes a single frame card"""
+        card = self.compose(design, None, enumerate(design.segments))
+        if card is None:
+            card = Image.new('RGBA', self.size, self.bg)
+
+        if self.stages is not None:
+            stage_start = time.perf_counter()
+        image_file_object = encode(card, design.output)
+        if self.stages is not None:
+            self.record("encode", stage_start)
+
+        return image_file_object
+
+    def compose(self, design: RenderPlan, card: Optional[Image.Image],
+                segments: Iterable[Tuple[int, Segment]]) -> Optional[Image.Image]:
+        """Pastes numbered segments onto card in order, starting from the first static layer when card is None"""
+        for n, segment in segments:
+            if not segment.static:
+                if card is None:
+                    card = Image.new('RGBA', self.size, self.bg)
+                draw = ImageDraw.Draw(card)
+                for i in segment.items:
+                    if self.perm_check(i):
+                        self.paste_object(card, draw, design, i)
+                continue
+
+            if self.stages is not None:
+                stage_start = time.perf_counter()
+
+            layer = self.static_layer(design, n, segment)
+            if card is None:
+                card = layer.copy()
+            else:
+                image, mask, xy = layer
+                if image is not None:
+                    card.paste(image, xy, mask)
+
+            if self.stages is not None:
+                self.record("layers", stage_start)
+
+        return card
+
+    def static_layer(self, design: RenderPlan, n: int, segment: Segment):
+        """Cached composite of a static segment, the whole canvas when it is the first segment and an
+        (image, mask, offset) paste otherwise"""
+        key = (design.name, design.version, n, self.bits & segment.role_mask, self.scale)
+        layer = LAYER_CACHE.get(key)
+        if layer is None:
+            if n == 0:
+                layer = self.composite(design, segment.items)
+                LAYER_CACHE.put(key, layer, image_bytes(layer))
+            else:
+                layer = self.flatten(self.composite(design, segment.items))
+                LAYER_CACHE.put(key, layer, sum(image_bytes(im) for im in layer[:2] if im is not None))
+        return layer
+
+    def composite(self, design: RenderPlan, items):
+        # building a cached layer is timed as part of "layers"
+        stages, self.stages = self.stages, None
+
+        canvas = Image.new('RGBA', self.size, self.bg)
+        draw = ImageDraw.Draw(canvas)
+        for i in items:
+            if self.perm_check(i):
+                self.paste_object(canvas, draw, design, i)
+
+        self.stages = stages
+        return canvas
+
+    @staticmethod
+    def flatten(canvas: Image):
+        """Turns a layer composited onto transparency into an (image, mask, offset) paste"""
+        mask = canvas.getchannel("A")
+        box = mask.getbbox()
+        if box is None:
+            return None, None, (0, 0)
+
+        # pasting onto transparent black leaves the colour channels premultiplied by alpha
+        canvas = canvas.crop(box)
+        image = Image.frombytes("RGBa", canvas.size, canvas.tobytes()).convert("RGBA").convert("RGB")
+        return image, mask.crop(box), box[:2]
+
+    def perm_check(self, i: DesignObj):
+        return i.visible(self.bits)
+
+    def paste_object(self, card: Image, draw: ImageDraw, design: RenderPlan, i: DesignObj,
+                     pos: Optional[Tuple[int, int]] = None, anchor: Optional[str] = None):
+        """Pastes i, at pos and anchor instead of its own when placed by a group"""
+        if self.stages is not None:
+            stage_start = time.perf_counter()
+
+        pos = i.pos if pos is None else pos
+        anchor = i.anchor if anchor is None else anchor
+
+        if isinstance(i, DesignGroup):
+            self.paste_group(card, draw, design, i, pos)
+            stage = "group"
+
+        elif isinstance(i, DesignText):
+            self.paste_text(card, draw, design, i, pos, anchor)
+            stage = "text"
+
+        elif isinstance(i, DesignImage):
+            self.paste_image(card, design, i, pos, anchor)
+            stage = "image"
+
+        if self.stages is not None:
+            self.record(stage, stage_start)
+
+    def paste_text(self, card: Image, draw: ImageDraw, design: RenderPlan, i: DesignText, pos: Tuple[int, int],
+                   anchor: str):
+        text = i.text.format(**self.mem)
+        # text is fitted at full size, so it shrinks to the same step at every scale
+        font = design.get_font(i.font, self.font_size(fit_text(design, i, text)))
+
+        draw.text(xy=self.at(pos), anchor=text_anchor(anchor), text=text, font=font, fill=i.color)
+
+    def paste_image(self, card: Image, design: RenderPlan, i: DesignImage, pos: Tuple[int, int], anchor: str):
+        if i.image == "PFP":
+            if not self.mem['AVATAR']:
+                return
+            mask = ASSET_CACHE.get_mask(design.path(i.mask), design.version, self.scale) if i.mask else None
+            image, mask = AVATAR_CACHE.decode(self.mem.get('AVATAR_KEY'), self.mem['AVATAR'], self.bounds(i), mask,
+                                              (design.version, i.mask) if i.mask else None)
+        else:
+            image, mask = ASSET_CACHE.get_image(design.path(i), (i.max_width, i.max_height), version=design.version,
+                                                scale=self.scale)
+            if i.mask:
+                mask = ASSET_CACHE.get_mask(design.path(i.mask), design.version, self.scale)
+
+        xy = size_anchor(self.at(pos), image.size, anchor)
+        card.paste(image, xy, mask)
+
+    def paste_group(self, card: Image, draw: ImageDraw, design: RenderPlan, i: DesignGroup, pos: Tuple[int, int]):
+        contents = [c for c in i.contents if self.perm_check(c)]
+        for obj, xy, _ in i.layout(pos, contents):
+            self.paste_object(card, draw, design, obj, xy, i.anchor)
+
+
+# "numpy" is experimental: with the bundled designs it benchmarks no faster than "pil", often slower at p99, and
+# antialiased edges differ from "pil" by more than rounding, so cards aren't pixel identical between the two.
+# bench.py --engines pil numpy measures both and counts the differing pixels.
+ENGINES = ("pil", "numpy")
+
+
+def card_class(engine: str = "pil") -> Type[CardImage]:
+    """The CardImage class for a compositing engine, "numpy" needs NumPy installed and isn't pixel identical"""
+    if engine == "pil":
+        return CardImage
+    if engine == "numpy":
+        from Objects.ArrayCard import ArrayCardImage
+        return ArrayCardImage
+    raise ValueError(f"Unknown render engine {engine!r}, expected one of {', '.join(ENGINES)}")
+
+
+def warm(plan: RenderPlan):
+    """Decodes every asset a plan can paste into the asset cache"""
+    for i in walk(plan.items):
+        if isinstance(i, DesignImage):
+            if i.image != "PFP":
+                ASSET_CACHE.get_image(plan.path(i), (i.max_width, i.max_height), version=plan.version)
+            if i.mask:
+                ASSET_CACHE.get_mask(plan.path(i.mask), plan.version)
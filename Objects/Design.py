@@ -1,3 +1,4 @@
+import io
 import json
 from typing import Tuple, List, Union, Optional, Dict
 
@@ -21,15 +22,16 @@ def load_design_from_json(file_path, trail=None):
     d.fonts = {k: {} for k in data['fonts']}
 
     groupsdata = data['objects']['groups']
-    groups = {}
-    while True:
-        if not groupsdata:
-            break
-        g = next(i for i in groupsdata if 'group' not in i or i['group'] in groups)
+    groups = d.groups
+    while groupsdata:
+        # parents first, a group whose parent is never added would otherwise be waited for forever
+        g = next((i for i in groupsdata if 'group' not in i or i['group'] in groups), None)
+        if g is None:
+            raise ValueError("Groups inside a missing group or a loop of groups: " +
+                             ", ".join(f"{i['name']} (in {i['group']})" for i in groupsdata))
         groupsdata.remove(g)
         gr = d.add_group(**g)
         groups[gr.name] = gr
-    d.groups = groups
 
     for t in data['objects']['text']:
         if isinstance(t['color'], str):
@@ -42,21 +44,25 @@ def load_design_from_json(file_path, trail=None):
     d.sort_items()
     for g in d.groups.values():
         g.sort()
+        g.compile_layout()
 
     return d
 
 
 class Design:
-    def __init__(self, *, name: str, default_layer: int = 10, folder_path: str):
+    def __init__(self, *, name: str, default_layer: int = 10, folder_path: str, output: Optional[Dict] = None):
         self.name: str = name
         self.default_layer: int = default_layer
         self.folder_path: str = folder_path
+        self.output: Dict = output or {}
 
         self.default_pos = (0, 0)
         self.default_anchor = ""
 
         self.fonts = {}
         self.font_paths = {}
+        # font files already in memory, from a bundle
+        self.font_data: Dict[str, bytes] = {}
         self.groups: Dict[str, DesignGroup] = {}
         self.items: List[DesignObj] = []
 
@@ -84,7 +90,9 @@ class Design:
 
     def get_font(self, name: str, size: int):
         if size not in self.fonts[name]:
-            self.fonts[name][size] = truetype(self.path(self.font_paths[name]), size)
+            data = self.font_data.get(name)
+            source = io.BytesIO(data) if data is not None else self.path(self.font_paths[name])
+            self.fonts[name][size] = truetype(source, size)
         return self.fonts[name][size]
 
     def add_text(self, *, text: str, font: str, size: int, max_height: int = None, max_width: int = None,
@@ -135,5 +143,10 @@ class Design:
 
         new_group = DesignGroup(name=name, queue=queue, max_height=max_height, max_width=max_width, pos=pos,
                                 anchor=anchor, layer=layer, roles=roles, group=group, group_layer=group_layer)
-        self.items.append(new_group)
+
+        if not group:
+            self.items.append(new_group)
+        else:
+            group.add_item(new_group)
+
         return new_group
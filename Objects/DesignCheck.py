@@ -0,0 +1,367 @@
+import io
+import json
+import os
+import string
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from PIL import Image
+from PIL.ImageFont import truetype
+
+from Objects.AssetCache import ASSET_CACHE, fit_size, image_bytes
+from Objects.AvatarCache import AVATAR_CACHE
+from Objects.CardImage import LAYER_CACHE, REFERENCE_SIZE, card_class
+from Objects.DesignGroup import DesignGroup
+from Objects.DesignImage import DesignImage
+from Objects.DesignText import DesignText
+from Objects.Encoder import ANIMATED_FORMATS, FORMATS
+from Objects.MemberIndex import MemberRecord
+from Objects.RenderPlan import RenderPlan, compile_design, visible_objects, walk
+from Objects.RoleBits import ROLE_KEYS
+from Objects.TextLayout import fit_text, size_steps
+
+# the longest names Discord allows, in its widest letter
+WORST_MEMBER = {"USERNAME": "W" * 32, "DISCRIMINATOR": "0000", "NICKNAME": "W" * 32,
+                "JOINED": datetime(2023, 12, 31, 23, 59, 59)}
+
+# keys of the member info dict text can use
+MEMBER_KEYS = frozenset(MemberRecord(0, "", "0", None, None, None, 0, None).info())
+WORST_INFO = {**{k: "" for k in MEMBER_KEYS}, **WORST_MEMBER}
+
+
+def is_number(v) -> bool:
+    return isinstance(v, (int, float)) and not isinstance(v, bool)
+
+
+def is_int(v) -> bool:
+    return isinstance(v, int) and not isinstance(v, bool)
+
+
+def is_point(v) -> bool:
+    return isinstance(v, list) and len(v) == 2 and all(is_number(c) for c in v)
+
+
+def is_slot(v) -> bool:
+    return isinstance(v, list) and len(v) in (2, 3) and all(is_int(c) for c in v)
+
+
+def is_color(v) -> bool:
+    return isinstance(v, list) and len(v) in (3, 4) and all(is_int(c) and 0 <= c <= 255 for c in v)
+
+
+# kind -> (description, check)
+KINDS: Dict[str, Tuple[str, Callable[[Any], bool]]] = {
+    "str": ("a string", lambda v: isinstance(v, str)),
+    "int": ("a whole number", is_int),
+    "size": ("a positive whole number", lambda v: is_int(v) and v > 0),
+    "dict": ("an object", lambda v: isinstance(v, dict)),
+    "point": ("an [x, y] pair", is_point),
+    "anchor": ("letters from LRUTDB", lambda v: isinstance(v, str) and set(v) <= set("LRUTDB")),
+    "queue": ("a list of [x, y] or [x, y, layer] slots", lambda v: isinstance(v, list) and all(is_slot(s) for s in v)),
+    "color": ("a colour name or [r, g, b, a] list", lambda v: isinstance(v, str) or is_color(v)),
+    "roles": ("a list of role keys", lambda v: isinstance(v, list) and all(isinstance(r, (str, int)) for r in v)),
+}
+
+# fields every object of a kind may have, name -> (kind, required)
+PLACEMENT = {"pos": ("point", False), "anchor": ("anchor", False), "layer": ("int", False), "roles": ("roles", False),
+             "max_width": ("size", False), "max_height": ("size", False), "group": ("str", False),
+             "group_layer": ("int", False)}
+
+SCHEMA: Dict[str, Dict[str, Tuple[str, bool]]] = {
+    "info": {"name": ("str", True), "folder_path": ("str", True), "default_layer": ("int", False),
+             "output": ("dict", False)},
+    "groups": {"name": ("str", True), "queue": ("queue", True), **PLACEMENT},
+    "text": {"text": ("str", True), "font": ("str", True), "size": ("size", True), "color": ("color", True),
+             **PLACEMENT},
+    "images": {"image": ("str", True), "mask": ("str", False), **PLACEMENT},
+}
+
+
+def check_fields(where: str, obj: Any, fields: Dict[str, Tuple[str, bool]]) -> List[str]:
+    if not isinstance(obj, dict):
+        return [f"{where} must be an object"]
+    errors = [f"{where} has an unknown field {k!r}" for k in obj if k not in fields]
+    for name, (kind, required) in fields.items():
+        if name not in obj:
+            if required:
+                errors.append(f"{where} is missing {name!r}")
+            continue
+        description, check = KINDS[kind]
+        if not check(obj[name]):
+            errors.append(f"{where}: {name} must be {description}, not {obj[name]!r}")
+    return errors
+
+
+def check_schema(data: Any) -> List[str]:
+    """Structural errors in a design's JSON, every field load_design_from_json passes on has to be one it accepts"""
+    if not isinstance(data, dict):
+        return ["design must be an object"]
+    errors = [f"design is missing {k!r}" for k in ("info", "fonts", "objects") if k not in data]
+    errors += [f"design has an unknown section {k!r}" for k in data if k not in ("info", "fonts", "colors", "objects")]
+
+    if "info" in data:
+        errors += check_fields("info", data["info"], SCHEMA["info"])
+    for section, kind in (("fonts", "str"), ("colors", "color")):
+        values = data.get(section, {})
+        if not isinstance(values, dict):
+            errors.append(f"{section} must be an object")
+            continue
+        description, check = KINDS[kind]
+        errors += [f"{section}: {k} must be {description}" for k, v in values.items() if not check(v)]
+
+    objects = data.get("objects", {})
+    if not isinstance(objects, dict):
+        return errors + ["objects must be an object"]
+    for kind in ("groups", "text", "images"):
+        items = objects.get(kind)
+        if not isinstance(items, list):
+            errors.append(f"objects is missing the {kind!r} list")
+            continue
+        for n, obj in enumerate(items):
+            errors += check_fields(f"{kind}[{n}]", obj, SCHEMA[kind])
+    return errors
+
+
+def label(kind: str, n: int, obj: Dict[str, Any]) -> str:
+    name = obj.get("name") or obj.get("image") or obj.get("text")
+    return f"{kind}[{n}] ({name})" if name else f"{kind}[{n}]"
+
+
+def check_references(data: Dict[str, Any], folder: str) -> List[str]:
+    """Groups, fonts, colours, files, role keys and text fields a schema-valid design refers to that don't exist"""
+    errors = []
+    fonts, colors = data["fonts"], data.get("colors", {})
+    objects = data["objects"]
+
+    # a parent that is missing or part of a loop never gets added, load_design_from_json gives up on it
+    parents = {g["name"]: g.get("group") for g in objects["groups"]}
+    for n, g in enumerate(objects["groups"]):
+        seen = {g["name"]}
+        parent = g.get("group")
+        while parent is not None:
+            if parent not in parents:
+                errors.append(f"{label('groups', n, g)} is in group {parent!r}, which doesn't exist")
+                break
+            if parent in seen:
+                errors.append(f"{label('groups', n, g)} is in a loop of groups")
+                break
+            seen.add(parent)
+            parent = parents[parent]
+
+    for kind in ("text", "images"):
+        for n, obj in enumerate(objects[kind]):
+            if "group" in obj and obj["group"] not in parents:
+                errors.append(f"{label(kind, n, obj)} is in group {obj['group']!r}, which doesn't exist")
+
+    for kind in ("groups", "text", "images"):
+        for n, obj in enumerate(objects[kind]):
+            for r in obj.get("roles") or []:
+                if str(r).lstrip("~") not in ROLE_KEYS:
+                    errors.append(f"{label(kind, n, obj)} needs role {r!r}, which isn't a key of ROLE_PERMS")
+
+    for name, file in fonts.items():
+        path = os.path.join(folder, file)
+        try:
+            truetype(path, 10)
+        except OSError as e:
+            errors.append(f"font {name!r} can't be loaded from {path}: {e}")
+
+    for n, t in enumerate(objects["text"]):
+        if t["font"] not in fonts:
+            errors.append(f"{label('text', n, t)} uses font {t['font']!r}, which isn't in fonts")
+        if isinstance(t["color"], str) and t["color"] not in colors:
+            errors.append(f"{label('text', n, t)} uses colour {t['color']!r}, which isn't in colors")
+        try:
+            fields = [f for _, f, _, _ in string.Formatter().parse(t["text"]) if f is not None]
+        except ValueError as e:
+            errors.append(f"{label('text', n, t)} isn't a valid format string: {e}")
+            continue
+        unknown = {f.split(".")[0].split("[")[0] for f in fields} - MEMBER_KEYS
+        for key in sorted(unknown):
+            errors.append(f"{label('text', n, t)} shows {{{key}}}, members have no {key!r}")
+        if not unknown:
+            try:
+                t["text"].format(**WORST_INFO)
+            except (ValueError, TypeError, AttributeError, IndexError, KeyError) as e:
+                errors.append(f"{label('text', n, t)} can't be formatted: {type(e).__name__}: {e}")
+
+    for n, i in enumerate(objects["images"]):
+        for file in (i["image"] if i["image"] != "PFP" else None, i.get("mask")):
+            if file is None:
+                continue
+            path = os.path.join(folder, file)
+            try:
+                with Image.open(path) as image:
+                    image.verify()
+            except (OSError, SyntaxError) as e:
+                errors.append(f"{label('images', n, i)} can't open {path}: {e}")
+
+    output = data["info"].get("output") or {}
+    if output.get("format", "png") not in FORMATS:
+        errors.append(f"output format {output['format']!r} isn't one of {', '.join(FORMATS)}")
+    animated = output.get("animated")
+    if isinstance(animated, dict) and animated.get("format", "webp") not in ANIMATED_FORMATS:
+        errors.append(f"animated format {animated['format']!r} isn't one of {', '.join(ANIMATED_FORMATS)}")
+    return errors
+
+
+def worst_bits(plan: RenderPlan) -> List[int]:
+    """Role bits of every member that could see the most of a design
+
+    Holding a key only ever shows more, unless something is hidden from it with "~KEY", so every key is held except
+    some combination of the negated ones.
+    """
+    every = (1 << len(ROLE_KEYS)) - 1
+    negated = 0
+    for i in walk(plan.items):
+        negated |= i.forbid_bits & every
+    keys = [b for b in ROLE_KEYS.values() if negated & b]
+
+    candidates = []
+    for n in range(1 << len(keys)):
+        drop = sum(b for k, b in enumerate(keys) if n >> k & 1)
+        candidates.append(every & ~drop)
+    return candidates
+
+
+def check_queues(plan: RenderPlan) -> List[str]:
+    """Groups that can have more visible contents than queue slots, which fails in DesignGroup.layout"""
+    errors = []
+    for g in {g for g in walk(plan.items) if isinstance(g, DesignGroup)}:
+        most = max(sum(c.visible(bits) for c in g.contents) for bits in worst_bits(plan))
+        if most > len(g.queue):
+            errors.append(f"group {g.name!r} can show {most} items but has {len(g.queue)} queue slots")
+    return errors
+
+
+def render_cost(plan: RenderPlan, bits: int) -> Dict[str, Any]:
+    """Estimated cost of a full size card for a member with these role bits and the longest possible names
+
+    Cold is a render with empty caches, warm one with the static layers already composited.
+    """
+    canvas = REFERENCE_SIZE[0] * REFERENCE_SIZE[1]
+    visible = set(visible_objects(plan.items, bits))
+
+    areas: Dict[Any, int] = {}
+    fonts: Set[Tuple[str, int]] = set()
+    asset_bytes = 0
+    for i in visible:
+        if isinstance(i, DesignImage):
+            if i.image == "PFP":
+                areas[i] = fit_size((1024, 1024), i.max_width, i.max_height)
+            else:
+                image, mask = ASSET_CACHE.get_image(plan.path(i), (i.max_width, i.max_height), version=plan.version)
+                areas[i] = image.size
+                asset_bytes += image_bytes(image) + (image_bytes(mask) if mask is not None else 0)
+            if i.mask:
+                asset_bytes += image_bytes(ASSET_CACHE.get_mask(plan.path(i.mask), plan.version))
+
+        elif isinstance(i, DesignText):
+            text = i.text.format(**WORST_INFO)
+            # fitting can measure text at every size step on the way down
+            steps = size_steps(i.size) if i.max_width or i.max_height else (i.size,)
+            fonts.update((i.font, s) for s in steps)
+            left, top, right, bottom = plan.get_font(i.font, fit_text(plan, i, text)).getbbox(text)
+            areas[i] = (right - left, bottom - top)
+
+    area = {i: w * h for i, (w, h) in areas.items()}
+    static = [s for s in plan.segments if s.static]
+    dynamic = [i for s in plan.segments if not s.static for i in s.items if i in visible]
+
+    return {
+        "pastes": len(area),
+        "area": sum(area.values()) + canvas * len(static),
+        "warm_pastes": sum(i in area for d in dynamic for i in visible_objects([d], bits)) + len(static),
+        "warm_area": sum(area.get(i, 0) for d in dynamic for i in visible_objects([d], bits)) + canvas * len(static),
+        "font_sizes": len(fonts),
+        "memory": asset_bytes + canvas * 4 * len(static),
+    }
+
+
+def worst_member(bits: int) -> Dict[str, Any]:
+    avatar = io.BytesIO()
+    Image.radial_gradient("L").resize((1024, 1024)).convert("RGB").save(avatar, format="png")
+    return {**WORST_MEMBER, "AVATAR": avatar.getvalue(), "AVATAR_KEY": "check", "ROLE_BITS": bits, "WIDTH": None}
+
+
+def time_renders(plan: RenderPlan, bits: int, iterations: int = 5, engine: str = "pil") -> Dict[str, float]:
+    """Milliseconds to render the worst case card with empty caches, and the median with warm ones"""
+    card = card_class(engine)
+    mem = worst_member(bits)
+
+    for cache in (ASSET_CACHE, AVATAR_CACHE, LAYER_CACHE):
+        cache.clear()
+    start = time.perf_counter()
+    card(mem).imager(plan)
+    cold = time.perf_counter() - start
+
+    warm = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        card(mem).imager(plan)
+        warm.append(time.perf_counter() - start)
+    return {"cold_ms": cold * 1000, "warm_ms": sorted(warm)[len(warm) // 2] * 1000}
+
+
+class DesignReport:
+    """What check_design found wrong with a design, and what its worst case card costs to render"""
+
+    def __init__(self, file_path: str):
+        self.file_path: str = file_path
+        self.errors: List[str] = []
+        self.plan: Optional[RenderPlan] = None
+        self.bits: Optional[int] = None
+        self.cost: Dict[str, Any] = {}
+
+    @property
+    def ok(self) -> bool:
+        return not self.errors
+
+    def over_budget(self, max_ms: Optional[float] = None, max_cold_ms: Optional[float] = None,
+                    max_mb: Optional[float] = None) -> List[str]:
+        over = []
+        if max_ms is not None and self.cost.get("warm_ms", 0) > max_ms:
+            over.append(f"renders in {self.cost['warm_ms']:.1f} ms, over the {max_ms:g} ms budget")
+        if max_cold_ms is not None and self.cost.get("cold_ms", 0) > max_cold_ms:
+            over.append(f"renders cold in {self.cost['cold_ms']:.1f} ms, over the {max_cold_ms:g} ms budget")
+        if max_mb is not None and self.cost.get("memory", 0) > max_mb * 1024 * 1024:
+            over.append(f"caches {self.cost['memory'] / 1024 / 1024:.1f} MB, over the {max_mb:g} MB budget")
+        return over
+
+
+def check_design(file_path: str, trail: Optional[str] = None, *, timed: bool = True,
+                 engine: str = "pil") -> DesignReport:
+    """Validates a design JSON, compiles it and estimates its worst case render cost, stopping at the first stage
+    with errors"""
+    report = DesignReport(file_path)
+    try:
+        with open(file_path) as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        report.errors.append(f"can't read {file_path}: {e}")
+        return report
+
+    report.errors = check_schema(data)
+    if report.errors:
+        return report
+    folder = data["info"]["folder_path"]
+    report.errors = check_references(data, os.path.join(trail, folder) if trail else folder)
+    if report.errors:
+        return report
+
+    try:
+        report.plan = compile_design(file_path, trail)
+    except Exception as e:
+        report.errors.append(f"can't compile: {type(e).__name__}: {e}")
+        return report
+
+    report.errors = check_queues(report.plan)
+    if report.errors:
+        return report
+
+    costs = [(render_cost(report.plan, bits), bits) for bits in worst_bits(report.plan)]
+    report.cost, report.bits = max(costs, key=lambda c: (c[0]["area"], c[0]["pastes"]))
+    if timed:
+        report.cost.update(time_renders(report.plan, report.bits, engine=engine))
+    return report
@@ -1,4 +1,5 @@
-from typing import List, Tuple
+from statistics import mean
+from typing import List, Sequence, Tuple
 
 from Objects.DesignObj import DesignObj
 
@@ -10,8 +11,37 @@ class DesignGroup(DesignObj):
         self.queue: List[Tuple[int, int]] = queue
         self.contents: List[DesignObj] = []
 
+        # layouts[n] holds the (x, y, layer) offsets of the first n queue slots, centred according to the anchor
+        self.layouts: Tuple[Tuple[Tuple[int, int, int], ...], ...] = ()
+
     def add_item(self, item: DesignObj):
         self.contents.append(item)
 
     def sort(self):
         self.contents.sort(key=lambda x: x.group_layer if x.group_layer else -1)
+
+    def compile_layout(self):
+        center_x = not any(a in self.anchor for a in "LR")
+        center_y = not any(a in self.anchor for a in "UTDB")
+
+        layouts = []
+        for n in range(len(self.queue) + 1):
+            slots = self.queue[:n]
+            dx = int(mean(s[0] for s in slots)) if slots and center_x else 0
+            dy = int(mean(s[1] for s in slots)) if slots and center_y else 0
+            layouts.append(tuple((s[0] - dx, s[1] - dy, s[2] if len(s) == 3 else -1) for s in slots))
+        self.layouts = tuple(layouts)
+
+    def layout(self, pos: Tuple[int, int],
+               contents: Sequence[DesignObj]) -> List[Tuple[DesignObj, Tuple[int, int], int]]:
+        """(object, position, layer) for each visible item placed at pos, in paste order, without changing them
+
+        Nested groups are placed like any other item and lay out their own contents with their own queue and anchor.
+        """
+        if len(contents) >= len(self.layouts):
+            raise IndexError(f"Not enough positions in the queue of group {self.name} for all the group items")
+
+        gx, gy = pos
+        placed = [(obj, (gx + x, gy + y), layer) for obj, (x, y, layer) in zip(contents, self.layouts[len(contents)])]
+        placed.sort(key=lambda p: p[2])
+        return placed
@@ -1,5 +1,7 @@
 from typing import Tuple, List, Union, Optional
 
+from Objects.RoleBits import compile_roles
+
 
 class DesignObj:
     def __init__(self, *, pos: Tuple[int, int], max_height: int = None, max_width: int = None, layer: int, anchor: str,
@@ -13,3 +15,8 @@ class DesignObj:
         self.max_width: int = max_width
         self.group = group
         self.group_layer: Optional[int] = group_layer
+
+        self.need_bits, self.forbid_bits = compile_roles(roles)
+
+    def visible(self, bits: int) -> bool:
+        return bits & self.need_bits == self.need_bits and not bits & self.forbid_bits
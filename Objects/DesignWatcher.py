@@ -0,0 +1,161 @@
+import asyncio
+import io
+import logging
+import os
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple, Type
+
+from PIL import Image
+
+from Objects.AssetCache import ASSET_CACHE
+from Objects.CardImage import CardImage, LAYER_CACHE, card_class, warm
+from Objects.Metrics import METRICS
+from Objects.RenderPlan import DesignStore, RenderPlan, stamp
+from Objects.ResultCache import RESULT_CACHE
+from Objects.RoleBits import ROLE_IDS
+from Objects.TextLayout import MEASURE_CACHE
+
+try:
+    from inotify_simple import INotify, flags
+except ImportError:
+    INotify = None
+
+log = logging.getLogger(__name__)
+
+
+def trial_avatar() -> bytes:
+    buffer = io.BytesIO()
+    Image.radial_gradient("L").convert("RGB").save(buffer, format="png")
+    return buffer.getvalue()
+
+
+def check(plan: RenderPlan, card: Type[CardImage] = CardImage):
+    """Decodes every asset of a plan and renders it for a member with no roles and one with every role
+
+    Raises whatever the render would have raised for a real member, and leaves the caches warm for the new version.
+    """
+    warm(plan)
+    avatar = trial_avatar()
+    for roles in ([], list(ROLE_IDS)):
+        mem = {
+            "USERNAME": "blurple",
+            "DISCRIMINATOR": "0001",
+            "NICKNAME": "Blurple",
+            "AVATAR": avatar,
+            "AVATAR_KEY": None,
+            "ROLES": roles,
+            "JOINED": datetime(2021, 5, 1)
+        }
+        card(mem).imager(plan)
+
+
+class DesignWatcher:
+    """Recompiles designs in the background when their JSON, assets or fonts change on disk
+
+    A changed design is compiled, checked and warmed off the event loop, then swapped into the store in one step.
+    Renders that already hold the old plan finish with it. An edit that fails to compile or render is rejected and
+    reported in errors, and the old version stays live. The trial render uses the same engine as real renders, so an
+    edit that only breaks under one engine is rejected too.
+
+    Uses inotify when inotify_simple is installed, otherwise polls every interval seconds.
+    """
+
+    def __init__(self, store: DesignStore, *, interval: float = 1.0, engine: str = "pil"):
+        self.store: DesignStore = store
+        self.interval: float = interval
+        self.card: Type[CardImage] = card_class(engine)
+
+        self.errors: Dict[str, str] = {}
+        self.rejected: Dict[str, Tuple] = {}
+        self.reloads: int = 0
+
+        self.inotify = INotify() if INotify is not None else None
+        self.watched: Set[str] = set()
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self.watch()
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        if self.inotify is not None:
+            self.inotify.close()
+            self.inotify = None
+
+    def watch(self):
+        """Adds inotify watches for every folder a live design reads from"""
+        if self.inotify is None:
+            return
+        folders = {os.path.dirname(os.path.abspath(f)) for p in self.store.loaded.values() for f in p.files}
+        mask = flags.CLOSE_WRITE | flags.MOVED_TO | flags.CREATE | flags.DELETE
+        for folder in folders - self.watched:
+            try:
+                self.inotify.add_watch(folder, mask)
+            except OSError:
+                continue
+            self.watched.add(folder)
+
+    async def wait(self):
+        if self.inotify is None:
+            await asyncio.sleep(self.interval)
+        else:
+            # wakes up early on changes, read_delay lets an editor finish writing a batch of files
+            await asyncio.to_thread(self.inotify.read, int(self.interval * 1000), 100)
+
+    def pending(self) -> List[str]:
+        """Changed files, leaving out edits that were already rejected and haven't changed since"""
+        files = []
+        for f in self.store.changed():
+            plan = self.store.loaded.get(f)
+            if f in self.rejected and self.rejected[f] == stamp(plan.files if plan else [self.store.source(f)]):
+                continue
+            files.append(f)
+        return files
+
+    async def run(self):
+        while True:
+            await self.wait()
+            for file in await asyncio.to_thread(self.pending):
+                await self.reload(file)
+
+    async def reload(self, file: str) -> Optional[RenderPlan]:
+        old = self.store.loaded.get(file)
+        watched = stamp(old.files if old else [self.store.source(file)])
+        try:
+            plan = await asyncio.to_thread(self.prepare, file, old)
+        except Exception as e:
+            self.rejected[file] = watched
+            self.errors[file] = f"{type(e).__name__}: {e}"
+            METRICS.inc("design_reloads", result="rejected")
+            log.error("Rejected edit to design %s, keeping the live version: %s", file, self.errors[file])
+            return None
+
+        self.rejected.pop(file, None)
+        self.errors.pop(file, None)
+        self.store.swap(file, plan)
+        if old is not None and old.version != plan.version:
+            self.retire(old)
+        self.reloads += 1
+        self.watch()
+
+        METRICS.inc("design_reloads", result="swapped")
+        log.info("Reloaded design %s (%s)", plan.name, plan.version[:8])
+        return plan
+
+    def prepare(self, file: str, old: Optional[RenderPlan]) -> RenderPlan:
+        plan = self.store.compile(file)
+        if old is not None and plan.name != old.name:
+            raise ValueError(f"design was renamed from {old.name!r} to {plan.name!r}, restart to rename a design")
+        check(plan, self.card)
+        return plan
+
+    @staticmethod
+    def retire(plan: RenderPlan):
+        RESULT_CACHE.invalidate(plan.name)
+        LAYER_CACHE.discard_where(lambda k: k[0] == plan.name and k[1] == plan.version)
+        ASSET_CACHE.retire(plan.version)
+        MEASURE_CACHE.discard_where(lambda k: k[0] == plan.name and k[1] == plan.version)
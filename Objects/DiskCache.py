@@ -0,0 +1,191 @@
+import contextlib
+import fcntl
+import hashlib
+import mmap
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Hashable, Iterator, Optional
+
+
+class DiskCache:
+    """Content addressed files under a folder, bounded by their total size with least recently used eviction
+
+    Entries are written to a temporary file and renamed into place, so a reader sees a whole file or none. Every
+    put, eviction and hit is appended to an index log, which is replayed at startup instead of scanning the folder,
+    and which processes sharing the folder read from where they left off to see each other's changes. Puts and
+    evictions hold an flock on the folder, hits only append.
+    """
+
+    def __init__(self, folder: str, max_bytes: int):
+        self.folder: str = folder
+        self.max_bytes: int = max_bytes
+
+        # name -> size, least recently used first
+        self.entries: "OrderedDict[str, int]" = OrderedDict()
+        self.bytes: int = 0
+
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+
+        self.index_path: str = os.path.join(folder, "index")
+        self.inode: Optional[int] = None
+        self.offset: int = 0
+        self.lines: int = 0
+
+        os.makedirs(folder, exist_ok=True)
+        self.lock = threading.Lock()
+        self.lock_fd: int = os.open(os.path.join(folder, "lock"), os.O_RDWR | os.O_CREAT, 0o644)
+        with self.locked():
+            if not os.path.exists(self.index_path):
+                self.rebuild()
+            self.catch_up()
+
+    @contextlib.contextmanager
+    def locked(self) -> Iterator[None]:
+        # flock excludes other processes, the lock other threads sharing this process's file descriptor
+        with self.lock:
+            fcntl.flock(self.lock_fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self.lock_fd, fcntl.LOCK_UN)
+
+    @staticmethod
+    def name(namespace: str, key: Hashable) -> str:
+        return hashlib.sha256(f"{namespace}\0{key}".encode()).hexdigest()
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.folder, name[:2], name)
+
+    def rebuild(self):
+        """Writes an index of the files already in the folder, oldest first, for a folder without one"""
+        files = []
+        for sub in os.scandir(self.folder):
+            if not sub.is_dir() or len(sub.name) != 2:
+                continue
+            for f in os.scandir(sub.path):
+                if f.name.endswith(".tmp"):
+                    os.unlink(f.path)
+                    continue
+                st = f.stat()
+                files.append((st.st_mtime, f.name, st.st_size))
+        files.sort()
+        self.write_index(f"P {name} {size}\n" for _, name, size in files)
+
+    def write_index(self, lines):
+        tmp = f"{self.index_path}.tmp"
+        with open(tmp, "w") as f:
+            f.writelines(lines)
+        os.replace(tmp, self.index_path)
+
+    def append(self, line: str):
+        # a single small O_APPEND write lands whole even without the lock
+        fd = os.open(self.index_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line.encode())
+        finally:
+            os.close(fd)
+
+    def catch_up(self):
+        """Applies index lines appended since this process last read it, rereading it if it was compacted"""
+        try:
+            f = open(self.index_path, "rb")
+        except FileNotFoundError:
+            return
+        with f:
+            inode = os.fstat(f.fileno()).st_ino
+            if inode != self.inode:
+                self.inode, self.offset, self.lines = inode, 0, 0
+                self.entries.clear()
+                self.bytes = 0
+            f.seek(self.offset)
+            data = f.read()
+
+        end = data.rfind(b"\n") + 1
+        self.offset += end
+        for line in data[:end].decode().splitlines():
+            self.lines += 1
+            op, name, *rest = line.split()
+            if op == "P":
+                self.bytes += int(rest[0]) - self.entries.get(name, 0)
+                self.entries[name] = int(rest[0])
+            elif op == "T":
+                if name in self.entries:
+                    self.entries.move_to_end(name)
+            elif op == "D":
+                self.bytes -= self.entries.pop(name, 0)
+
+    def get(self, namespace: str, key: Hashable) -> Optional[bytes]:
+        name = self.name(namespace, key)
+        try:
+            with open(self.path(name), "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.touch(name)
+        return data
+
+    def map(self, namespace: str, key: Hashable) -> Optional[mmap.mmap]:
+        """Maps an entry read only, the mapping stays valid after the entry is evicted"""
+        name = self.name(namespace, key)
+        try:
+            with open(self.path(name), "rb") as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (FileNotFoundError, ValueError):
+            self.misses += 1
+            return None
+        self.touch(name)
+        return mapped
+
+    def touch(self, name: str):
+        self.hits += 1
+        with self.lock:
+            if name in self.entries:
+                self.entries.move_to_end(name)
+        self.append(f"T {name}\n")
+
+    def put(self, namespace: str, key: Hashable, data: bytes):
+        if len(data) > self.max_bytes:
+            return
+        name = self.name(namespace, key)
+        path = self.path(name)
+
+        with self.locked():
+            self.catch_up()
+            if name not in self.entries or not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp = f"{path}.{os.getpid()}.tmp"
+                with open(tmp, "wb") as f:
+                    f.write(data)
+                os.replace(tmp, path)
+                self.append(f"P {name} {len(data)}\n")
+            else:
+                self.append(f"T {name}\n")
+            self.catch_up()
+
+            while self.bytes > self.max_bytes and self.entries:
+                old = next(iter(self.entries))
+                try:
+                    os.unlink(self.path(old))
+                except FileNotFoundError:
+                    pass
+                self.append(f"D {old}\n")
+                self.catch_up()
+                self.evictions += 1
+
+            if self.lines > 2 * len(self.entries) + 1024:
+                self.write_index(f"P {n} {size}\n" for n, size in self.entries.items())
+                self.catch_up()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self.entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions
+        }
@@ -0,0 +1,119 @@
+import io
+import threading
+import time
+from typing import Any, Dict, List, Mapping, Optional
+
+from PIL import Image
+
+FORMATS = ("png", "webp", "jpeg")
+ANIMATED_FORMATS = ("webp", "gif")
+
+
+class EncodeStats:
+    """Encode count, time and output size per format"""
+
+    def __init__(self):
+        self.formats: Dict[str, Dict[str, float]] = {}
+        self.lock = threading.Lock()
+
+    def record(self, fmt: str, seconds: float, size: int):
+        with self.lock:
+            s = self.formats.setdefault(fmt, {"count": 0, "seconds": 0.0, "bytes": 0})
+            s["count"] += 1
+            s["seconds"] += seconds
+            s["bytes"] += size
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        with self.lock:
+            return {
+                fmt: dict(s, avg_ms=s["seconds"] * 1000 / s["count"], avg_kb=s["bytes"] / 1024 / s["count"])
+                for fmt, s in self.formats.items()
+            }
+
+
+ENCODE_STATS = EncodeStats()
+
+
+def has_transparency(card: Image.Image) -> bool:
+    return "A" in card.getbands() and card.getchannel("A").getextrema()[0] < 255
+
+
+def encode(card: Image.Image, options: Optional[Mapping[str, Any]] = None) -> io.BytesIO:
+    """Encodes a card using a design's output options
+
+    format: "png" (default), "webp" or "jpeg"
+    png: compress_level (0-9, default 6), optimize, colors (quantize to a palette of this many colours)
+    webp: lossless, quality (0-100), method (0-6, higher is slower and smaller)
+    jpeg: quality, optimize, subsampling, cards with transparency are encoded with the png options instead
+    """
+    options = options or {}
+    fmt = options.get("format", "png").lower()
+    if fmt == "jpg":
+        fmt = "jpeg"
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown output format {fmt!r}, expected one of {', '.join(FORMATS)}")
+
+    if fmt == "jpeg" and has_transparency(card):
+        fmt = "png"
+
+    image = card
+    if fmt == "png":
+        kwargs = {"compress_level": options.get("compress_level", 6), "optimize": options.get("optimize", False)}
+        if options.get("colors"):
+            image = card.quantize(options["colors"], method=Image.Quantize.FASTOCTREE)
+    elif fmt == "webp":
+        kwargs = {"lossless": options.get("lossless", False), "quality": options.get("quality", 90),
+                  "method": options.get("method", 4)}
+    else:
+        image = card.convert("RGB")
+        kwargs = {"quality": options.get("quality", 90), "optimize": options.get("optimize", False),
+                  "subsampling": options.get("subsampling", 0)}
+
+    start = time.perf_counter()
+    buffer = io.BytesIO()
+    image.save(buffer, format=fmt, **kwargs)
+    ENCODE_STATS.record(fmt, time.perf_counter() - start, buffer.tell())
+
+    buffer.seek(0)
+    return buffer
+
+
+def encode_animated(frames: Image.Image, durations: List[int],
+                    options: Optional[Mapping[str, Any]] = None) -> io.BytesIO:
+    """Encodes every frame of an animated card, seeking frames one at a time so they can be rendered on demand
+
+    format: "webp" (default) or "gif"
+    webp: lossless, quality (0-100, default 80), method (0-6), frames are streamed into the encoder
+    gif: Pillow palettises and keeps every frame until the file is written
+    loop: times to play, 0 (default) loops forever
+    """
+    options = options or {}
+    fmt = options.get("format", "webp").lower()
+    if fmt not in ANIMATED_FORMATS:
+        raise ValueError(f"Unknown animated format {fmt!r}, expected one of {', '.join(ANIMATED_FORMATS)}")
+
+    kwargs = {"save_all": True, "duration": durations, "loop": options.get("loop", 0)}
+    if fmt == "webp":
+        kwargs.update(lossless=options.get("lossless", False), quality=options.get("quality", 80),
+                      method=options.get("method", 4))
+    else:
+        kwargs.update(disposal=1)
+
+    start = time.perf_counter()
+    buffer = io.BytesIO()
+    frames.save(buffer, format=fmt, **kwargs)
+    ENCODE_STATS.record(f"animated_{fmt}", time.perf_counter() - start, buffer.tell())
+
+    buffer.seek(0)
+    return buffer
+
+
+def extension(data: bytes) -> str:
+    """File extension of an encoded card, from its magic bytes"""
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "webp"
+    if data[:3] == b"\xff\xd8\xff":
+        return "jpg"
+    if data[:4] == b"GIF8":
+        return "gif"
+    return "png"
@@ -0,0 +1,97 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+
+class LRUCache:
+    """Thread-safe least-recently-used cache bounded by the total size of its values"""
+
+    def __init__(self, max_bytes: int, *, ttl: Optional[float] = None):
+        self.max_bytes: int = max_bytes
+        self.ttl: Optional[float] = ttl
+
+        self.entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.bytes: int = 0
+
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+
+        self.lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[2] is not None and entry[2] < time.monotonic():
+                self._remove(key)
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return default
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: Hashable, value: Any, size: int):
+        if size > self.max_bytes:
+            return
+
+        expires = time.monotonic() + self.ttl if self.ttl else None
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (value, size, expires)
+            self.bytes += size
+
+            while self.bytes > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self.lock:
+            if key not in self.entries:
+                return default
+            return self._remove(key)
+
+    def discard_where(self, predicate: Callable[[Hashable], bool]) -> int:
+        with self.lock:
+            keys = [k for k in self.entries if predicate(k)]
+            for k in keys:
+                self._remove(k)
+        return len(keys)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def resize(self, max_bytes: int):
+        with self.lock:
+            self.max_bytes = max_bytes
+            while self.bytes > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def _remove(self, key: Hashable) -> Any:
+        value, size, _ = self.entries.pop(key)
+        self.bytes -= size
+        return value
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self.entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions
+        }
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key: Hashable):
+        return key in self.entries
@@ -0,0 +1,120 @@
+import sys
+from datetime import datetime
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from Objects.RoleBits import member_bits
+
+CDN = "https://cdn.discordapp.com"
+
+
+class MemberRecord:
+    """What a profile card shows of a member, with their roles reduced to design role bits"""
+
+    __slots__ = ("id", "name", "discriminator", "nick", "avatar", "guild_avatar", "bits", "joined")
+
+    def __init__(self, id: int, name: str, discriminator: str, nick: Optional[str], avatar: Optional[str],
+                 guild_avatar: Optional[str], bits: int, joined: Optional[datetime]):
+        self.id: int = id
+        self.name: str = name
+        self.discriminator: str = sys.intern(discriminator)
+        self.nick: Optional[str] = nick
+        self.avatar: Optional[str] = avatar
+        self.guild_avatar: Optional[str] = guild_avatar
+        self.bits: int = bits
+        self.joined: Optional[datetime] = joined
+
+    @classmethod
+    def from_member(cls, member) -> "MemberRecord":
+        """From a discord.Member"""
+        return cls(member.id, member.name, member.discriminator, member.nick,
+                   member.avatar.key if member.avatar else None,
+                   member.guild_avatar.key if member.guild_avatar else None,
+                   member_bits(r.id for r in member.roles), member.joined_at)
+
+    @classmethod
+    def from_payload(cls, data: Dict[str, Any]) -> "MemberRecord":
+        """From a gateway member object"""
+        user = data["user"]
+        joined = data.get("joined_at")
+        return cls(int(user["id"]), user["username"], user.get("discriminator", "0"), data.get("nick"),
+                   user.get("avatar"), data.get("avatar"), member_bits(int(r) for r in data.get("roles", ())),
+                   datetime.fromisoformat(joined) if joined else None)
+
+    @property
+    def avatar_key(self) -> str:
+        """Key of the avatar the card shows, the same as discord.Member.display_avatar.key"""
+        if self.guild_avatar:
+            return self.guild_avatar
+        if self.avatar:
+            return self.avatar
+        return str(self.default_avatar)
+
+    @property
+    def default_avatar(self) -> int:
+        if self.discriminator in ("0", "0000"):
+            return (self.id >> 22) % 6
+        return int(self.discriminator) % 5
+
+    def avatar_url(self, guild_id: int) -> str:
+        if self.guild_avatar:
+            ext = "gif" if self.guild_avatar.startswith("a_") else "png"
+            return f"{CDN}/guilds/{guild_id}/users/{self.id}/avatars/{self.guild_avatar}.{ext}?size=1024"
+        if self.avatar:
+            ext = "gif" if self.avatar.startswith("a_") else "png"
+            return f"{CDN}/avatars/{self.id}/{self.avatar}.{ext}?size=1024"
+        return f"{CDN}/embed/avatars/{self.default_avatar}.png"
+
+    def info(self, width: Optional[int] = None) -> Dict[str, Any]:
+        """The member info dict CardImage renders"""
+        return {
+            "USERNAME": self.name,
+            "DISCRIMINATOR": self.discriminator,
+            "NICKNAME": self.nick or "",
+            "AVATAR": None,
+            "AVATAR_KEY": self.avatar_key,
+            "ROLE_BITS": self.bits,
+            "JOINED": self.joined,
+            "WIDTH": width
+        }
+
+
+class MemberIndex:
+    """The members of one guild as MemberRecords, in place of discord.py's member cache
+
+    Filled from a chunk of the guild's members and kept current from raw GUILD_MEMBER_ADD, GUILD_MEMBER_UPDATE and
+    GUILD_MEMBER_REMOVE events, so the bot can run without caching members or presences.
+    """
+
+    EVENTS = ("GUILD_MEMBER_ADD", "GUILD_MEMBER_UPDATE", "GUILD_MEMBER_REMOVE")
+
+    def __init__(self, guild_id: int):
+        self.guild_id: int = guild_id
+        self.members: Dict[int, MemberRecord] = {}
+        self.ready: bool = False
+
+    def __len__(self) -> int:
+        return len(self.members)
+
+    def get(self, member_id: int) -> Optional[MemberRecord]:
+        return self.members.get(member_id)
+
+    def load(self, members: Iterable):
+        """Replaces the index with a chunk of discord.Member objects"""
+        self.members = {m.id: MemberRecord.from_member(m) for m in members}
+        self.ready = True
+
+    def add(self, record: MemberRecord):
+        self.members[record.id] = record
+
+    def apply(self, event: str, data: Dict[str, Any]) -> Tuple[Optional[MemberRecord], Optional[MemberRecord]]:
+        """Applies a member event's payload, returns the member's (old, new) records"""
+        if event not in self.EVENTS or int(data.get("guild_id", 0)) != self.guild_id:
+            return None, None
+
+        if event == "GUILD_MEMBER_REMOVE":
+            return self.members.pop(int(data["user"]["id"]), None), None
+
+        record = MemberRecord.from_payload(data)
+        old = self.members.get(record.id)
+        self.members[record.id] = record
+        return old, record
@@ -0,0 +1,194 @@
+import asyncio
+import bisect
+import json
+import random
+import threading
+import time
+from contextlib import nullcontext
+from typing import Callable, Dict, List, Optional, Tuple
+
+BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+
+Key = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+def metric_key(name: str, labels: Dict[str, str]) -> Key:
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def format_key(key: Key, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    name, labels = key
+    labels = labels + extra
+    if not labels:
+        return name
+    return name + "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+class Histogram:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts: List[int] = [0] * len(BUCKETS)
+        self.sum: float = 0.0
+        self.count: int = 0
+
+    def observe(self, value: float):
+        i = bisect.bisect_left(BUCKETS, value)
+        if i < len(BUCKETS):
+            self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Span:
+    __slots__ = ("metrics", "key", "start")
+
+    def __init__(self, metrics: "Metrics", key: Key):
+        self.metrics = metrics
+        self.key = key
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe_key(self.key, time.perf_counter() - self.start)
+
+
+class Metrics:
+    """Counters, latency histograms and collected gauges for the renderer
+
+    Counters are always updated. Latency spans are only recorded for sampled requests, see sampled().
+    """
+
+    def __init__(self, sample_rate: float = 0.1):
+        self.sample_rate: float = sample_rate
+        self.counters: Dict[Key, float] = {}
+        self.histograms: Dict[Key, Histogram] = {}
+        self.gauges: Dict[Key, Callable[[], float]] = {}
+        self.lock = threading.Lock()
+
+    def sampled(self) -> bool:
+        return self.sample_rate >= 1 or random.random() < self.sample_rate
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = metric_key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, **labels):
+        self.observe_key(metric_key(name, labels), seconds)
+
+    def observe_key(self, key: Key, seconds: float):
+        with self.lock:
+            h = self.histograms.get(key)
+            if h is None:
+                h = self.histograms[key] = Histogram()
+            h.observe(seconds)
+
+    def gauge(self, name: str, fn: Callable[[], float], **labels):
+        """Registers a value that is read whenever metrics are exported"""
+        self.gauges[metric_key(name, labels)] = fn
+
+    def span(self, name: str, sampled: bool = True, **labels):
+        """Times a with block into the name histogram, does nothing when the request isn't sampled"""
+        return Span(self, metric_key(name, labels)) if sampled else nullcontext()
+
+    def collect_gauges(self) -> Dict[Key, float]:
+        values = {}
+        for key, fn in list(self.gauges.items()):
+            try:
+                values[key] = float(fn())
+            except Exception:
+                continue
+        return values
+
+    def prometheus(self) -> str:
+        lines = []
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {k: (list(h.counts), h.sum, h.count) for k, h in self.histograms.items()}
+
+        typed = set()
+
+        def header(name, kind):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} {kind}")
+
+        for key, value in sorted(counters.items()):
+            header(key[0], "counter")
+            lines.append(f"{format_key(key)} {value}")
+
+        for key, value in sorted(self.collect_gauges().items()):
+            header(key[0], "gauge")
+            lines.append(f"{format_key(key)} {value}")
+
+        for key, (counts, total, count) in sorted(histograms.items()):
+            header(key[0], "histogram")
+            cumulative = 0
+            for bound, c in zip(BUCKETS, counts):
+                cumulative += c
+                lines.append(f"{format_key((key[0] + '_bucket', key[1]), (('le', str(bound)),))} {cumulative}")
+            lines.append(f"{format_key((key[0] + '_bucket', key[1]), (('le', '+Inf'),))} {count}")
+            lines.append(f"{format_key((key[0] + '_sum', key[1]))} {total}")
+            lines.append(f"{format_key((key[0] + '_count', key[1]))} {count}")
+
+        return "\n".join(lines) + "\n"
+
+    def dump(self) -> Dict:
+        with self.lock:
+            counters = {format_key(k): v for k, v in self.counters.items()}
+            histograms = {
+                format_key(k): {"count": h.count, "sum": h.sum, "avg": h.sum / h.count if h.count else 0.0}
+                for k, h in self.histograms.items()
+            }
+        return {
+            "sample_rate": self.sample_rate,
+            "counters": counters,
+            "gauges": {format_key(k): v for k, v in self.collect_gauges().items()},
+            "histograms": histograms
+        }
+
+
+class MetricsServer:
+    """Serves /metrics (Prometheus text format) and /metrics.json over plain HTTP"""
+
+    def __init__(self, metrics: "Metrics", host: str = "127.0.0.1", port: int = 9108):
+        self.metrics = metrics
+        self.host: str = host
+        self.port: int = port
+        self.server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, self.host, self.port)
+
+    async def stop(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), 5)
+            path = request.split(b" ", 2)[1].decode(errors="replace")
+
+            if path == "/metrics":
+                status, kind, body = "200 OK", "text/plain; version=0.0.4", self.metrics.prometheus()
+            elif path == "/metrics.json":
+                status, kind, body = "200 OK", "application/json", json.dumps(self.metrics.dump())
+            else:
+                status, kind, body = "404 Not Found", "text/plain", "not found\n"
+
+            data = body.encode()
+            writer.write(f"HTTP/1.1 {status}\r\nContent-Type: {kind}\r\nContent-Length: {len(data)}\r\n"
+                         f"Connection: close\r\n\r\n".encode() + data)
+            await writer.drain()
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, IndexError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+METRICS = Metrics()
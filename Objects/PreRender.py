@@ -0,0 +1,152 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Set, Tuple
+
+from Objects.Metrics import METRICS
+from Objects.RenderBackend import RenderBusy
+
+log = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Allows rate events a second on average, in bursts of up to burst"""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate: float = rate
+        self.burst: int = burst
+        self.tokens: float = burst
+        self.updated: float = time.monotonic()
+
+    def take(self) -> float:
+        """Takes a token and returns 0, or returns the seconds until one is available"""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class PreRenderer:
+    """Re-renders the cards of recently active members in the background when something on them changes
+
+    touch() is called from gateway events. Repeated touches of a member within delay seconds of each other are
+    debounced into one render, renders start at most rate times a second, and at most max_pending members wait at a
+    time, so a mass role assignment is spread out and trimmed instead of taking every render worker. Only members
+    seen() within the last active seconds are rendered, their cards are the ones likely to be asked for again.
+
+    render(member, context) is awaited for each render, with the context given to the member's last seen().
+    """
+
+    def __init__(self, render: Callable[[Hashable, Any], Awaitable[None]], *, delay: float = 5.0, rate: float = 2.0,
+                 burst: int = 10, active: float = 86400, max_pending: int = 10000):
+        self.render: Callable[[Hashable, Any], Awaitable[None]] = render
+        self.delay: float = delay
+        self.bucket: TokenBucket = TokenBucket(rate, burst)
+        self.active: float = active
+        self.max_pending: int = max_pending
+
+        # member -> (time last seen, context), oldest first
+        self.seen_at: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        # member -> time its render is due, earliest first since every touch moves a member to the end
+        self.pending: "OrderedDict[Hashable, float]" = OrderedDict()
+        self.running: Set[asyncio.Task] = set()
+
+        self.rendered: int = 0
+        self.dropped: int = 0
+        self.failed: int = 0
+
+        self.wakeup: Optional[asyncio.Event] = None
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self.wakeup = asyncio.Event()
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        tasks = list(self.running)
+        if self.task is not None:
+            tasks.append(self.task)
+            self.task = None
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.pending.clear()
+
+    def seen(self, member: Hashable, context: Any = None):
+        """Marks a member whose card was just asked for"""
+        now = time.monotonic()
+        self.seen_at[member] = (now, context)
+        self.seen_at.move_to_end(member)
+        while self.seen_at and next(iter(self.seen_at.values()))[0] < now - self.active:
+            self.seen_at.popitem(last=False)
+
+    def touch(self, member: Hashable):
+        """Schedules a render of an active member's card, delay seconds after the last change"""
+        seen = self.seen_at.get(member)
+        if seen is None or seen[0] < time.monotonic() - self.active:
+            return
+        if member not in self.pending and len(self.pending) >= self.max_pending:
+            self.dropped += 1
+            METRICS.inc("prerender_requests", result="dropped")
+            return
+
+        self.pending[member] = time.monotonic() + self.delay
+        self.pending.move_to_end(member)
+        METRICS.inc("prerender_requests", result="queued")
+        if self.wakeup is not None:
+            self.wakeup.set()
+
+    async def run(self):
+        while True:
+            if not self.pending:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+
+            member, due = next(iter(self.pending.items()))
+            wait = due - time.monotonic()
+            if wait <= 0:
+                wait = self.bucket.take()
+                if wait <= 0:
+                    del self.pending[member]
+                    task = asyncio.create_task(self.prerender(member))
+                    self.running.add(task)
+                    task.add_done_callback(self.running.discard)
+                    continue
+
+            # a touch can move the head of the queue, so wait for the first of the two
+            self.wakeup.clear()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+
+    async def prerender(self, member: Hashable):
+        seen = self.seen_at.get(member)
+        try:
+            await self.render(member, seen[1] if seen else None)
+        except RenderBusy:
+            # left for /profile to render when it's asked for
+            self.dropped += 1
+            METRICS.inc("prerender_requests", result="busy")
+        except Exception:
+            self.failed += 1
+            METRICS.inc("prerender_requests", result="failed")
+            log.exception("Pre-rendering the card of %s failed", member)
+        else:
+            self.rendered += 1
+            METRICS.inc("prerender_requests", result="rendered")
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "active": len(self.seen_at),
+            "pending": len(self.pending),
+            "running": len(self.running),
+            "rendered": self.rendered,
+            "dropped": self.dropped,
+            "failed": self.failed
+        }
@@ -0,0 +1,100 @@
+import asyncio
+import base64
+import io
+import itertools
+import json
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from Objects.CardImage import card_scale
+from Objects.RenderBackend import RenderBusy
+from Objects.RenderPlan import DesignStore, RenderPlan
+
+
+class RenderServerError(Exception):
+    """Raised when no render endpoint could produce a card"""
+
+
+def pack_request(design: str, mem: Dict[str, Any], version: Optional[str] = None) -> bytes:
+    body = dict(mem)
+    body["AVATAR"] = base64.b64encode(mem["AVATAR"]).decode() if mem.get("AVATAR") else None
+    body["JOINED"] = mem["JOINED"].isoformat() if mem.get("JOINED") else None
+    return json.dumps({"design": design, "version": version, "member": body}).encode()
+
+
+def unpack_request(data: bytes) -> Tuple[str, Optional[str], Dict[str, Any]]:
+    """The design name, the design version the card is wanted at, None for any, and the member"""
+    body = json.loads(data)
+    mem = body["member"]
+    mem["AVATAR"] = base64.b64decode(mem["AVATAR"]) if mem.get("AVATAR") else None
+    mem["JOINED"] = datetime.fromisoformat(mem["JOINED"]) if mem.get("JOINED") else None
+    if mem.get("ROLE_BITS") is not None:
+        mem["ROLE_BITS"] = int(mem["ROLE_BITS"])
+    else:
+        mem["ROLES"] = [int(r) for r in mem.get("ROLES", [])]
+    card_scale(mem.get("WIDTH"))
+    return body["design"], body.get("version"), mem
+
+
+class RemoteRenderer:
+    """Render backend that sends renders to a pool of render_server.py endpoints
+
+    Has the same interface as RenderBackend, so the RenderScheduler can sit in front of either. Requests carry the
+    plan's version, and a server that has compiled a different version of the design answers 409 rather than render
+    a card that would be cached under the wrong version.
+    """
+
+    def __init__(self, endpoints: List[str], *, workers: int = 8, timeout: float = 10, retries: int = 1):
+        if not endpoints:
+            raise ValueError("RemoteRenderer needs at least one endpoint")
+
+        self.endpoints: List[str] = [e.rstrip("/") for e in endpoints]
+        self.workers: int = workers
+        self.timeout: float = timeout
+        self.retries: int = retries
+        self.full: bool = False
+
+        self.rotation = itertools.cycle(range(len(self.endpoints)))
+        self.session = None
+
+    def start(self, store: DesignStore):
+        pass
+
+    def shutdown(self):
+        if self.session is not None:
+            asyncio.ensure_future(self.session.close())
+            self.session = None
+
+    def get_session(self):
+        if self.session is None:
+            import aiohttp
+
+            connector = aiohttp.TCPConnector(limit_per_host=self.workers, keepalive_timeout=30)
+            self.session = aiohttp.ClientSession(connector=connector,
+                                                 timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self.session
+
+    async def render(self, plan: RenderPlan, mem: Dict[str, Any], *,
+                     stages: Optional[Dict[str, float]] = None) -> io.BytesIO:
+        import aiohttp
+
+        session = self.get_session()
+        body = pack_request(plan.name, mem, plan.version)
+        error: Optional[Exception] = None
+
+        for _ in range(min(len(self.endpoints), 1 + self.retries)):
+            endpoint = self.endpoints[next(self.rotation)]
+            try:
+                async with session.post(f"{endpoint}/render", data=body,
+                                        headers={"Content-Type": "application/json"}) as resp:
+                    if resp.status == 503:
+                        raise RenderBusy()
+                    if resp.status != 200:
+                        raise RenderServerError(f"{endpoint} returned {resp.status}: {await resp.text()}")
+                    return io.BytesIO(await resp.read())
+            except (aiohttp.ClientError, asyncio.TimeoutError, RenderBusy, RenderServerError) as e:
+                error = e
+
+        if isinstance(error, RenderBusy):
+            raise error
+        raise RenderServerError(f"All render endpoints failed: {error!r}") from error
@@ -0,0 +1,132 @@
+import asyncio
+import io
+import multiprocessing
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import Any, Dict, List, Optional, Tuple, Type
+
+from Objects.AssetCache import ASSET_CACHE
+from Objects.AvatarCache import AVATAR_CACHE
+from Objects.CardImage import CardImage, LAYER_CACHE, card_class, warm
+from Objects.DiskCache import DiskCache
+from Objects.LRUCache import LRUCache
+from Objects.RenderPlan import DesignStore, RenderPlan
+
+
+class RenderBusy(Exception):
+    """Raised when a render is requested while the render queue is full"""
+
+
+# designs compiled inside a process pool worker, and the CardImage class it renders with
+_store: Optional[DesignStore] = None
+_card: Type[CardImage] = CardImage
+
+# the caches a render uses, which a spawned worker creates again at their default sizes
+WORKER_CACHES: Dict[str, LRUCache] = {"asset": ASSET_CACHE, "layer": LAYER_CACHE, "avatar": AVATAR_CACHE}
+
+
+def init_worker(files: List[str], folder: str, engine: str = "pil", disk_cache: Optional[Tuple[str, int]] = None,
+                cache_sizes: Optional[Dict[str, int]] = None):
+    global _store, _card
+    _card = card_class(engine)
+    for name, max_bytes in (cache_sizes or {}).items():
+        WORKER_CACHES[name].resize(max_bytes)
+    if disk_cache is not None:
+        AVATAR_CACHE.disk = DiskCache(*disk_cache)
+    _store = DesignStore(files, folder)
+    _store.load_all()
+    for plan in _store.plans.values():
+        warm(plan)
+
+
+def _ping():
+    return os.getpid()
+
+
+def render_card(name: str, version: Optional[str], mem: Dict[str, Any],
+                traced: bool = False) -> Tuple[bytes, Optional[Dict[str, float]]]:
+    """Process pool entry point, renders with the worker's own copy of the design"""
+    plan = _store[name]
+    if plan.version != version:
+        try:
+            _store.refresh()
+        except Exception:
+            # the parent only swaps in versions that render, an edit made since then may still be half written
+            pass
+        plan = _store[name]
+    stages = {} if traced else None
+    return _card(mem, stages=stages).imager(plan).getvalue(), stages
+
+
+class RenderBackend:
+    """Runs CardImage renders inline, on a thread pool or on a process pool"""
+
+    KINDS = ("inline", "thread", "process")
+
+    def __init__(self, kind: str = "thread", *, workers: Optional[int] = None, max_queue: int = 64,
+                 engine: str = "pil", disk_cache: Optional[DiskCache] = None):
+        if kind not in self.KINDS:
+            raise ValueError(f"Unknown render backend {kind!r}, expected one of {', '.join(self.KINDS)}")
+
+        self.kind: str = kind
+        self.engine: str = engine
+        # process pool workers open the same folder, threads share the parent's caches
+        self.disk_cache: Optional[DiskCache] = disk_cache
+        self.card: Type[CardImage] = card_class(engine)
+        self.workers: int = workers or os.cpu_count() or 1
+        self.max_queue: int = max_queue
+        self.pending: int = 0
+        self.executor: Optional[Executor] = None
+
+    def start(self, store: DesignStore):
+        if self.kind == "thread":
+            self.executor = ThreadPoolExecutor(self.workers, thread_name_prefix="render")
+            for plan in store.plans.values():
+                warm(plan)
+
+        elif self.kind == "process":
+            disk = (self.disk_cache.folder, self.disk_cache.max_bytes) if self.disk_cache is not None else None
+            # each worker gets caches as large as the parent's, which were sized from config.py
+            sizes = {name: cache.max_bytes for name, cache in WORKER_CACHES.items()}
+            # spawned rather than forked, the parent is running the gateway's event loop and threads
+            self.executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"),
+                                                initializer=init_worker,
+                                                initargs=(store.files, store.folder, self.engine, disk, sizes))
+            for _ in range(self.workers):
+                self.executor.submit(_ping)
+
+        else:
+            for plan in store.plans.values():
+                warm(plan)
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    @property
+    def full(self) -> bool:
+        return self.pending >= self.max_queue
+
+    async def render(self, plan: RenderPlan, mem: Dict[str, Any], *,
+                     stages: Optional[Dict[str, float]] = None) -> io.BytesIO:
+        if self.full:
+            raise RenderBusy()
+
+        self.pending += 1
+        try:
+            if self.kind == "inline":
+                return self.card(mem, stages=stages).imager(plan)
+
+            loop = asyncio.get_running_loop()
+            if self.kind == "thread":
+                return await loop.run_in_executor(self.executor, partial(self.card(mem, stages=stages).imager, plan))
+
+            fn = partial(render_card, plan.name, plan.version, mem, stages is not None)
+            data, worker_stages = await loop.run_in_executor(self.executor, fn)
+            if worker_stages:
+                stages.update(worker_stages)
+            return io.BytesIO(data)
+        finally:
+            self.pending -= 1
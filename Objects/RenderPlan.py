@@ -0,0 +1,221 @@
+import hashlib
+import os
+from types import MappingProxyType
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple, Union
+
+from PIL.ImageFont import FreeTypeFont
+
+from Objects.AssetCache import ASSET_CACHE
+from Objects.Bundle import Bundle, open_bundle
+from Objects.Design import Design, load_design_from_json
+from Objects.DesignGroup import DesignGroup
+from Objects.DesignImage import DesignImage
+from Objects.DesignObj import DesignObj
+from Objects.DesignText import DesignText
+from Objects.RoleBits import member_bits
+
+
+def walk(items: Iterable[DesignObj]) -> Iterator[DesignObj]:
+    for i in items:
+        yield i
+        if isinstance(i, DesignGroup):
+            yield from walk(i.contents)
+
+
+def is_static(i: DesignObj) -> bool:
+    """Whether an object looks the same for every member that can see it"""
+    if isinstance(i, DesignGroup):
+        return all(is_static(c) for c in i.contents)
+    if isinstance(i, DesignImage):
+        return i.image != "PFP"
+    return False
+
+
+def role_mask(items: Iterable[DesignObj]) -> int:
+    """Every role bit that affects the visibility of items"""
+    mask = 0
+    for i in walk(items):
+        mask |= i.need_bits | i.forbid_bits
+    return mask
+
+
+def visible_objects(items: Iterable[DesignObj], bits: int) -> Iterator[DesignObj]:
+    for i in items:
+        if i.visible(bits):
+            yield i
+            if isinstance(i, DesignGroup):
+                yield from visible_objects(i.contents, bits)
+
+
+def stamp(files: Iterable[str]) -> Tuple[Optional[Tuple[int, int]], ...]:
+    """(mtime, size) of every file, None for files that are missing"""
+    stamps = []
+    for f in files:
+        try:
+            st = os.stat(f)
+        except OSError:
+            stamps.append(None)
+        else:
+            stamps.append((st.st_mtime_ns, st.st_size))
+    return tuple(stamps)
+
+
+class Segment(NamedTuple):
+    static: bool
+    items: Tuple[DesignObj, ...]
+    role_mask: int
+
+
+class RenderPlan:
+    """Compiled, read-only view of a Design that is shared between renders"""
+
+    __slots__ = ("design", "name", "source", "version", "mtime", "files", "stamp", "items", "segments", "role_mask",
+                 "fonts", "paths", "output")
+
+    def __init__(self, design: Design, *, source: Optional[str] = None, version: Optional[str] = None,
+                 mtime: Optional[float] = None):
+        self.design: Design = design
+        self.name: str = design.name
+        self.source: Optional[str] = source
+        self.version: Optional[str] = version
+        self.mtime: Optional[float] = mtime
+        self.files: Tuple[str, ...] = (source,) if source else ()
+        self.stamp: Tuple[Optional[Tuple[int, int]], ...] = stamp(self.files)
+
+        self.items: Tuple[DesignObj, ...] = tuple(sorted(design.items, key=lambda x: x.layer))
+
+        # consecutive runs of static and per-member items, in layer order
+        runs: List[Tuple[bool, List[DesignObj]]] = []
+        for i in self.items:
+            static = is_static(i)
+            if runs and runs[-1][0] == static:
+                runs[-1][1].append(i)
+            else:
+                runs.append((static, [i]))
+        self.segments: Tuple[Segment, ...] = tuple(
+            Segment(static, tuple(items), role_mask(items)) for static, items in runs
+        )
+        self.role_mask: int = role_mask(self.items)
+
+        fonts: Dict[Tuple[str, int], FreeTypeFont] = {}
+        paths: Dict[str, str] = {}
+        for i in walk(self.items):
+            if isinstance(i, DesignText):
+                fonts[(i.font, i.size)] = design.get_font(i.font, i.size)
+            elif isinstance(i, DesignImage):
+                if i.image != "PFP":
+                    paths[i.image] = design.path(i)
+                if i.mask:
+                    paths[i.mask] = design.path(i.mask)
+
+        self.fonts = MappingProxyType(fonts)
+        self.paths = MappingProxyType(paths)
+        self.output = MappingProxyType(dict(design.output))
+
+    def visible(self, role_ids: Iterable[int]) -> List[DesignObj]:
+        """Objects (including group contents) a member with these roles would see, without rendering"""
+        return list(visible_objects(self.items, member_bits(role_ids)))
+
+    def get_font(self, name: str, size: int) -> FreeTypeFont:
+        font = self.fonts.get((name, size))
+        if font is None:
+            font = self.design.get_font(name, size)
+        return font
+
+    def path(self, obj: Union[DesignObj, str]) -> str:
+        key = obj if isinstance(obj, str) else obj.image
+        p = self.paths.get(key)
+        if p is None:
+            p = self.design.path(obj)
+        return p
+
+
+def load_bundle(bundle: Bundle, file_path: str) -> RenderPlan:
+    """Builds a plan from a bundle, with the bundle's images mapped into the asset cache"""
+    ASSET_CACHE.map(bundle.version, bundle.images(), bundle.masks())
+    plan = RenderPlan(bundle.design(), source=file_path, version=bundle.version, mtime=os.stat(file_path).st_mtime)
+
+    # rebuilding the bundle or editing anything it was built from reloads the design
+    plan.files = (file_path, bundle.path, *sorted(set(bundle.index["sources"]) - {file_path}))
+    plan.stamp = stamp(plan.files)
+    return plan
+
+
+def compile_design(file_path: str, trail: Optional[str] = None) -> RenderPlan:
+    """Compiles a design, from its bundle when bundle.py has built an up to date one"""
+    bundle = open_bundle(file_path)
+    if bundle is not None:
+        return load_bundle(bundle, file_path)
+
+    with open(file_path, "rb") as f:
+        digest = hashlib.sha1(f.read())
+    mtime = os.stat(file_path).st_mtime
+
+    design = load_design_from_json(file_path, trail)
+    plan = RenderPlan(design, source=file_path, mtime=mtime)
+
+    # assets and fonts are part of the version, so replacing one invalidates caches like editing the JSON does
+    assets = sorted(set(plan.paths.values()) | {design.path(p) for p in design.font_paths.values()})
+    plan.files = (file_path, *assets)
+    plan.stamp = stamp(plan.files)
+    digest.update(repr(plan.stamp[1:]).encode())
+    plan.version = digest.hexdigest()
+    return plan
+
+
+class DesignStore:
+    """Holds the compiled plans for every configured design, keyed by design name
+
+    Plans are replaced whole, so a render holding a plan keeps using it while a newer one is swapped in.
+    """
+
+    def __init__(self, files: List[str], folder: str = "Designs"):
+        self.files: List[str] = files
+        self.folder: str = folder
+        self.plans: Dict[str, RenderPlan] = {}
+        self.loaded: Dict[str, RenderPlan] = {}
+
+    def source(self, file: str) -> str:
+        return f"{self.folder}/{file}.json"
+
+    def compile(self, file: str) -> RenderPlan:
+        return compile_design(self.source(file), self.folder)
+
+    def swap(self, file: str, plan: RenderPlan) -> Optional[RenderPlan]:
+        """Makes plan the live version of file, returns the plan it replaced"""
+        old = self.loaded.get(file)
+        self.loaded[file] = plan
+        self.plans[plan.name] = plan
+        if old is not None and old.name != plan.name and self.plans.get(old.name) is old:
+            del self.plans[old.name]
+        return old
+
+    def load(self, file: str) -> RenderPlan:
+        plan = self.compile(file)
+        self.swap(file, plan)
+        return plan
+
+    def load_all(self):
+        for f in self.files:
+            self.load(f)
+
+    def changed(self) -> List[str]:
+        """Files whose JSON, assets or fonts changed on disk since they were compiled"""
+        return [f for f in self.files if f not in self.loaded or stamp(self.loaded[f].files) != self.loaded[f].stamp]
+
+    def refresh(self) -> List[RenderPlan]:
+        """Recompiles designs that changed on disk, returns the new plans"""
+        reloaded = []
+        for f in self.changed():
+            old = self.loaded.get(f)
+            plan = self.compile(f)
+            self.swap(f, plan)
+            if old is None or plan.version != old.version:
+                reloaded.append(plan)
+        return reloaded
+
+    def __getitem__(self, name: str) -> RenderPlan:
+        return self.plans[name]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.plans
@@ -0,0 +1,206 @@
+import asyncio
+import io
+import time
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Hashable, List, Optional
+
+from Objects.Metrics import METRICS
+from Objects.RenderBackend import RenderBackend, RenderBusy
+from Objects.RenderPlan import RenderPlan
+
+
+class RenderJob:
+    __slots__ = ("key", "plan", "mem", "avatar", "future", "sampled", "enqueued", "background")
+
+    def __init__(self, key: Hashable, plan: RenderPlan, mem: Dict[str, Any],
+                 avatar: Optional[Callable[[], Awaitable[bytes]]], future: asyncio.Future, sampled: bool,
+                 background: bool = False):
+        self.key = key
+        self.plan = plan
+        self.mem = mem
+        self.avatar = avatar
+        self.future = future
+        self.sampled = sampled
+        self.enqueued: float = time.monotonic()
+        self.background: bool = background
+
+
+class RenderScheduler:
+    """Bounded render queue in front of a RenderBackend
+
+    Jobs are taken round-robin by guild, then by user within a guild, so one busy guild or user can't starve
+    the rest. Submitting a key that is already queued or rendering shares that render instead of adding a job.
+
+    Background jobs have their own queue and only run when no other job is waiting, on at most
+    background_concurrency workers at a time. Submitting the key of a queued background job moves it to the
+    normal queue.
+    """
+
+    def __init__(self, backend: RenderBackend, *, max_queue: int = 64, concurrency: Optional[int] = None,
+                 max_background: Optional[int] = None, background_concurrency: Optional[int] = None):
+        self.backend: RenderBackend = backend
+        self.max_queue: int = max_queue
+        self.concurrency: int = concurrency or backend.workers
+        self.max_background: int = max_queue if max_background is None else max_background
+        self.background_concurrency: int = background_concurrency or max(1, self.concurrency // 2)
+
+        # guild -> user -> jobs
+        self.queues: "OrderedDict[Hashable, OrderedDict[Hashable, Deque[RenderJob]]]" = OrderedDict()
+        self.inflight: Dict[Hashable, asyncio.Future] = {}
+        # key -> queued background job
+        self.background: "OrderedDict[Hashable, RenderJob]" = OrderedDict()
+
+        self.depth: int = 0
+        self.running: int = 0
+        self.running_background: int = 0
+        self.completed: int = 0
+        self.coalesced: int = 0
+        self.rejected: int = 0
+        self.waits: Deque[float] = deque(maxlen=1024)
+
+        self.wakeup: Optional[asyncio.Event] = None
+        self.tasks: List[asyncio.Task] = []
+
+    def start(self):
+        self.wakeup = asyncio.Event()
+        self.tasks = [asyncio.create_task(self.worker()) for _ in range(self.concurrency)]
+
+    async def stop(self):
+        for t in self.tasks:
+            t.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+        for users in self.queues.values():
+            for jobs in users.values():
+                for job in jobs:
+                    job.future.cancel()
+        self.queues.clear()
+        self.depth = 0
+
+        for job in self.background.values():
+            job.future.cancel()
+        self.background.clear()
+
+    @property
+    def full(self) -> bool:
+        return self.depth >= self.max_queue
+
+    async def submit(self, plan: RenderPlan, mem: Dict[str, Any], *, key: Hashable, guild: Hashable = None,
+                     user: Hashable = None, avatar: Optional[Callable[[], Awaitable[bytes]]] = None,
+                     sampled: bool = False, background: bool = False) -> io.BytesIO:
+        """Queues a render and waits for the card, avatar() is awaited for mem["AVATAR"] just before rendering"""
+        future = self.inflight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            METRICS.inc("render_requests", result="coalesced")
+            job = self.background.get(key)
+            if job is not None and not background:
+                del self.background[key]
+                self.enqueue(job, guild, user)
+        else:
+            full = len(self.background) >= self.max_background if background else self.full
+            if full:
+                self.rejected += 1
+                METRICS.inc("render_requests", result="busy")
+                raise RenderBusy()
+            METRICS.inc("render_requests", result="background" if background else "queued")
+
+            future = asyncio.get_running_loop().create_future()
+            self.inflight[key] = future
+            job = RenderJob(key, plan, mem, avatar, future, sampled, background)
+            if background:
+                self.background[key] = job
+                self.wakeup.set()
+            else:
+                self.enqueue(job, guild, user)
+
+        return io.BytesIO(await asyncio.shield(future))
+
+    def enqueue(self, job: RenderJob, guild: Hashable, user: Hashable):
+        job.background = False
+        users = self.queues.setdefault(guild, OrderedDict())
+        users.setdefault(user, deque()).append(job)
+        self.depth += 1
+        self.wakeup.set()
+
+    def next_job(self) -> Optional[RenderJob]:
+        if not self.queues:
+            if self.background and self.running_background < self.background_concurrency:
+                return self.background.popitem(last=False)[1]
+            return None
+
+        guild, users = next(iter(self.queues.items()))
+        user, jobs = next(iter(users.items()))
+        job = jobs.popleft()
+
+        if jobs:
+            users.move_to_end(user)
+        else:
+            del users[user]
+        if users:
+            self.queues.move_to_end(guild)
+        else:
+            del self.queues[guild]
+
+        self.depth -= 1
+        return job
+
+    async def worker(self):
+        while True:
+            job = self.next_job()
+            if job is None:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+
+            if not job.background:
+                wait = time.monotonic() - job.enqueued
+                self.waits.append(wait)
+                METRICS.observe("render_queue_wait_seconds", wait)
+
+            self.running += 1
+            if job.background:
+                self.running_background += 1
+            stages = {} if job.sampled else None
+            try:
+                if job.avatar is not None:
+                    with METRICS.span("render_stage_seconds", job.sampled, stage="avatar"):
+                        job.mem["AVATAR"] = await job.avatar()
+                buffer = await self.backend.render(job.plan, job.mem, stages=stages)
+            except asyncio.CancelledError:
+                job.future.cancel()
+                raise
+            except Exception as e:
+                job.future.set_exception(e)
+                job.future.exception()
+            else:
+                self.completed += 1
+                job.future.set_result(buffer.getvalue())
+                if stages:
+                    for stage, seconds in stages.items():
+                        METRICS.observe("render_stage_seconds", seconds, stage=stage)
+            finally:
+                self.running -= 1
+                if job.background:
+                    self.running_background -= 1
+                    # another background job may have been waiting for this one's slot
+                    self.wakeup.set()
+                if self.inflight.get(job.key) is job.future:
+                    del self.inflight[job.key]
+
+    def stats(self) -> Dict[str, Any]:
+        waits = sorted(self.waits)
+        return {
+            "depth": self.depth,
+            "running": self.running,
+            "background": len(self.background),
+            "running_background": self.running_background,
+            "max_queue": self.max_queue,
+            "completed": self.completed,
+            "coalesced": self.coalesced,
+            "rejected": self.rejected,
+            "wait_p50": waits[len(waits) // 2] if waits else 0.0,
+            "wait_p95": waits[int(len(waits) * 0.95)] if waits else 0.0,
+            "wait_max": waits[-1] if waits else 0.0
+        }
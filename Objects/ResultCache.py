@@ -0,0 +1,56 @@
+import asyncio
+import hashlib
+from typing import Any, Dict, Optional
+
+from Objects.DiskCache import DiskCache
+from Objects.LRUCache import LRUCache
+from Objects.RenderPlan import RenderPlan
+from Objects.RoleBits import info_bits
+
+
+def card_key(plan: RenderPlan, mem: Dict[str, Any]) -> str:
+    """Content address of a rendered card, covering everything that can change its pixels"""
+    avatar = mem.get("AVATAR_KEY")
+    if avatar is None and mem.get("AVATAR"):
+        avatar = hashlib.sha1(mem["AVATAR"]).hexdigest()
+
+    joined = mem["JOINED"].isoformat() if mem["JOINED"] else ""
+
+    h = hashlib.sha256()
+    for part in (plan.name, plan.version, info_bits(mem) & plan.role_mask,
+                 mem["USERNAME"], mem["NICKNAME"], mem["DISCRIMINATOR"], joined, avatar, mem.get("WIDTH")):
+        h.update(str(part).encode())
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+class ResultCache(LRUCache):
+    """Encoded cards, keyed by (design name, card_key)
+
+    When disk is set, cards are also kept there by card_key alone, which already covers the design version, so they
+    survive restarts and design reloads only make them unreachable. Disk reads and writes run in a thread, off the
+    event loop.
+    """
+
+    def __init__(self, max_bytes: int, **kwargs):
+        super().__init__(max_bytes, **kwargs)
+        self.disk: Optional[DiskCache] = None
+
+    async def get_card(self, plan: RenderPlan, key: str) -> Optional[bytes]:
+        data = self.get((plan.name, key))
+        if data is None and self.disk is not None:
+            data = await asyncio.to_thread(self.disk.get, "card", key)
+            if data is not None:
+                self.put((plan.name, key), data, len(data))
+        return data
+
+    async def put_card(self, plan: RenderPlan, key: str, data: bytes):
+        self.put((plan.name, key), data, len(data))
+        if self.disk is not None:
+            await asyncio.to_thread(self.disk.put, "card", key, data)
+
+    def invalidate(self, name: str) -> int:
+        return self.discard_where(lambda k: k[0] == name)
+
+
+RESULT_CACHE = ResultCache(64 * 1024 * 1024, ttl=3600)
@@ -0,0 +1,41 @@
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+from Designs.key import ROLE_PERMS
+
+# one bit per ROLE_PERMS key
+ROLE_KEYS: Dict[str, int] = {k: 1 << n for n, k in enumerate(ROLE_PERMS)}
+
+# a bit no member can hold, used for keys missing from ROLE_PERMS
+UNKNOWN: int = 1 << len(ROLE_KEYS)
+
+# discord role id -> bits of every key that role satisfies
+ROLE_IDS: Dict[int, int] = {}
+for _key, _ids in ROLE_PERMS.items():
+    for _id in ([_ids] if isinstance(_ids, int) else _ids):
+        ROLE_IDS[_id] = ROLE_IDS.get(_id, 0) | ROLE_KEYS[_key]
+
+
+def member_bits(role_ids: Iterable[int]) -> int:
+    bits = 0
+    for r in role_ids:
+        bits |= ROLE_IDS.get(r, 0)
+    return bits
+
+
+def info_bits(mem: Dict) -> int:
+    """Role bits of a member info dict, which has discord role ids in ROLES or bits already in ROLE_BITS"""
+    bits = mem.get("ROLE_BITS")
+    return member_bits(mem["ROLES"]) if bits is None else bits
+
+
+def compile_roles(roles: Optional[List[Union[str, int]]]) -> Tuple[int, int]:
+    """Compiles a design roles list into (required bits, forbidden bits), "~KEY" negates a key"""
+    need = forbid = 0
+    for r in roles or []:
+        r = str(r)
+        bit = ROLE_KEYS.get(r.lstrip("~"), UNKNOWN)
+        if r.startswith("~"):
+            forbid |= bit
+        else:
+            need |= bit
+    return need, forbid
@@ -0,0 +1,61 @@
+from functools import lru_cache
+from typing import Tuple
+
+from Objects.DesignText import DesignText
+from Objects.LRUCache import LRUCache
+
+MIN_SIZE = 8
+STEP = 0.94
+
+# (design name, design version, font, size, text) -> (advance width, ink height), a font name is only unique
+# within one version of one design
+MEASURE_CACHE = LRUCache(4 * 1024 * 1024)
+
+
+@lru_cache(maxsize=None)
+def size_steps(size: int) -> Tuple[int, ...]:
+    """Font sizes text of this design size may shrink to, largest first"""
+    steps = [size]
+    s = float(size)
+    while True:
+        s *= STEP
+        if round(s) < MIN_SIZE:
+            break
+        if round(s) < steps[-1]:
+            steps.append(round(s))
+    return tuple(steps)
+
+
+def measure(design, font: str, size: int, text: str) -> Tuple[float, int]:
+    key = (design.name, design.version, font, size, text)
+    m = MEASURE_CACHE.get(key)
+    if m is None:
+        f = design.get_font(font, size)
+        _, top, _, bottom = f.getbbox(text)
+        m = (f.getlength(text), bottom - top)
+        MEASURE_CACHE.put(key, m, 64 + len(text))
+    return m
+
+
+def fit_text(design, i: DesignText, text: str) -> int:
+    """Largest size step at which text fits i.max_width and i.max_height, never changes i"""
+    if not (i.max_width or i.max_height):
+        return i.size
+
+    def fits(size):
+        width, height = measure(design, i.font, size, text)
+        return (not i.max_width or width <= i.max_width) and (not i.max_height or height <= i.max_height)
+
+    steps = size_steps(i.size)
+    if fits(steps[0]) or len(steps) == 1:
+        return steps[0]
+
+    # steps are descending, so fits() goes from False to True once
+    lo, hi = 1, len(steps) - 1
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if fits(steps[mid]):
+            hi = mid
+        else:
+            lo = mid + 1
+    return steps[lo]
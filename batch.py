@@ -0,0 +1,249 @@
+"""Offline batch renderer for member snapshots
+
+Reads a JSON Lines file with one member per line and renders every card with a design, without logging in to Discord:
+
+    {"id": 1234, "name": "blurple", "nick": "", "discriminator": "0001", "roles": [1082567913103425626],
+     "joined": "2021-05-01T12:00:00+00:00", "avatar": "avatars/1234.png"}
+
+Cards are written to a directory, or to a .tar or .zip archive. Finished ids are appended to <output>.done, so
+running the same command again after a crash skips members that were already rendered. Cards for an archive are
+collected in <output>.parts and only archived once the run ends, so a crash never leaves a half written archive.
+
+    python batch.py members.jsonl cards/ --design default --workers 8
+    python batch.py members.jsonl cards.zip
+    python batch.py members.jsonl thumbs/ --width 256
+"""
+import argparse
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tarfile
+import time
+import zipfile
+from datetime import datetime
+from typing import Any, Dict, Iterator, Optional, Set
+
+from Objects.CardImage import ENGINES, card_class, card_scale, warm
+from Objects.Encoder import extension
+from Objects.RenderBackend import init_worker, render_card
+from Objects.RenderPlan import RenderPlan, compile_design
+
+
+def read_members(path: str) -> Iterator[Dict[str, Any]]:
+    with open(path) as f:
+        for n, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as e:
+                print(f"Skipping line {n}: {e}", file=sys.stderr)
+
+
+def member_info(snapshot: Dict[str, Any], base: str, width: Optional[int] = None) -> Dict[str, Any]:
+    """Builds the info dict ProfileCog.profile would, from a snapshot line"""
+    avatar = None
+    if snapshot.get("avatar"):
+        path = snapshot["avatar"]
+        if not os.path.isabs(path):
+            path = os.path.join(base, path)
+        with open(path, "rb") as f:
+            avatar = f.read()
+
+    joined = snapshot.get("joined")
+    return {
+        "USERNAME": snapshot.get("name", ""),
+        "DISCRIMINATOR": snapshot.get("discriminator", "0"),
+        "NICKNAME": snapshot.get("nick") or "",
+        "AVATAR": avatar,
+        "AVATAR_KEY": None,
+        "ROLES": [int(r) for r in snapshot.get("roles", [])],
+        "JOINED": datetime.fromisoformat(joined) if joined else None,
+        "WIDTH": width
+    }
+
+
+class Output:
+    """Writes cards to a directory, tar or zip archive and records finished ids for resuming
+
+    An archive only gets its index when it is closed, and one left open by a crash can't be appended to, so cards for
+    an archive are written to a <output>.parts directory like any other and archived in close().
+    """
+
+    def __init__(self, path: str):
+        self.path: str = path
+        self.progress_path: str = path.rstrip("/\\") + ".done"
+        self.done: Set[str] = set()
+        if os.path.exists(self.progress_path):
+            with open(self.progress_path) as f:
+                self.done = {line.strip() for line in f if line.strip()}
+
+        self.archive: Optional[str] = "tar" if path.endswith(".tar") else "zip" if path.endswith(".zip") else None
+        self.folder: str = f"{path}.parts" if self.archive else path
+        os.makedirs(self.folder, exist_ok=True)
+
+        self.progress = open(self.progress_path, "a")
+
+    def write(self, member_id: str, data: bytes):
+        name = f"{member_id}.{extension(data)}"
+        tmp = os.path.join(self.folder, f".{name}.tmp")
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, os.path.join(self.folder, name))
+
+        self.progress.write(f"{member_id}\n")
+        self.progress.flush()
+        self.done.add(member_id)
+
+    def close(self):
+        self.progress.close()
+        if self.archive is not None:
+            self.pack()
+
+    def pack(self):
+        """Replaces the archive with one holding its old cards and the new ones, then removes the parts directory"""
+        names = sorted(n for n in os.listdir(self.folder) if not n.startswith("."))
+        new = set(names)
+        tmp = f"{self.path}.tmp"
+
+        if self.archive == "tar":
+            with tarfile.open(tmp, "w") as out:
+                if os.path.exists(self.path):
+                    with tarfile.open(self.path) as old:
+                        for member in old.getmembers():
+                            if member.name not in new:
+                                out.addfile(member, old.extractfile(member))
+                for name in names:
+                    out.add(os.path.join(self.folder, name), arcname=name)
+        else:
+            with zipfile.ZipFile(tmp, "w", compression=zipfile.ZIP_STORED) as out:
+                if os.path.exists(self.path):
+                    with zipfile.ZipFile(self.path) as old:
+                        for info in old.infolist():
+                            if info.filename not in new:
+                                out.writestr(info, old.read(info))
+                for name in names:
+                    out.write(os.path.join(self.folder, name), arcname=name)
+
+        os.replace(tmp, self.path)
+        shutil.rmtree(self.folder)
+
+
+class Progress:
+    def __init__(self, total: int, skipped: int = 0, interval: float = 2.0):
+        self.total: int = total
+        self.skipped: int = skipped
+        self.interval: float = interval
+        self.count: int = 0
+        self.failed: int = 0
+        self.start: float = time.perf_counter()
+        self.last: float = self.start
+
+    def tick(self, failed: bool = False):
+        if failed:
+            self.failed += 1
+        else:
+            self.count += 1
+        if time.perf_counter() - self.last >= self.interval:
+            self.report()
+
+    def report(self):
+        now = self.last = time.perf_counter()
+        rate = self.count / (now - self.start) if now > self.start else 0.0
+        finished = self.skipped + self.count + self.failed
+
+        line = f"{finished}/{self.total}: {self.count} rendered, {self.failed} failed, {self.skipped} already done, " \
+               f"{rate:.1f} cards/s"
+        if rate:
+            line += f", ~{(self.total - finished) / rate:.0f}s left"
+        print(line, file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render profile cards for a JSON Lines file of member snapshots")
+    parser.add_argument("members", help="JSON Lines file of member snapshots")
+    parser.add_argument("output", help="output directory, or a .tar / .zip archive")
+    parser.add_argument("--design", default="default", help="design file in Designs/, without .json")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="render processes, 0 renders in this process")
+    parser.add_argument("--engine", default="pil", choices=ENGINES)
+    parser.add_argument("--in-flight", type=int, default=4, help="queued renders per worker")
+    parser.add_argument("--width", type=int, help="card width in pixels, the design's full size by default")
+    args = parser.parse_args()
+    try:
+        card_scale(args.width)
+    except ValueError as e:
+        parser.error(str(e))
+
+    plan: RenderPlan = compile_design(f"Designs/{args.design}.json", "Designs")
+    base = os.path.dirname(os.path.abspath(args.members))
+    output = Output(args.output)
+
+    with open(args.members) as f:
+        total = sum(1 for line in f if line.strip())
+    progress = Progress(total, len(output.done))
+
+    todo = (m for m in read_members(args.members) if str(m["id"]) not in output.done)
+
+    try:
+        if args.workers == 0:
+            warm(plan)
+            card = card_class(args.engine)
+            for snapshot in todo:
+                try:
+                    data = card(member_info(snapshot, base, args.width)).imager(plan).getvalue()
+                except Exception as e:
+                    print(f"Member {snapshot['id']} failed: {type(e).__name__}: {e}", file=sys.stderr)
+                    progress.tick(failed=True)
+                    continue
+                output.write(str(snapshot["id"]), data)
+                progress.tick()
+        else:
+            ctx = multiprocessing.get_context("spawn")
+            with concurrent.futures.ProcessPoolExecutor(args.workers, mp_context=ctx, initializer=init_worker,
+                                                        initargs=([args.design], "Designs", args.engine)) as pool:
+                pending: Dict[concurrent.futures.Future, str] = {}
+                limit = args.workers * args.in_flight
+
+                def drain(block: bool):
+                    if not pending:
+                        return
+                    done, _ = concurrent.futures.wait(
+                        pending, timeout=None if block else 0, return_when=concurrent.futures.FIRST_COMPLETED
+                    )
+                    for future in done:
+                        member_id = pending.pop(future)
+                        try:
+                            data, _ = future.result()
+                        except Exception as e:
+                            print(f"Member {member_id} failed: {type(e).__name__}: {e}", file=sys.stderr)
+                            progress.tick(failed=True)
+                            continue
+                        output.write(member_id, data)
+                        progress.tick()
+
+                for snapshot in todo:
+                    while len(pending) >= limit:
+                        drain(True)
+                    try:
+                        info = member_info(snapshot, base, args.width)
+                    except (OSError, ValueError) as e:
+                        print(f"Member {snapshot['id']} failed: {type(e).__name__}: {e}", file=sys.stderr)
+                        progress.tick(failed=True)
+                        continue
+                    pending[pool.submit(render_card, plan.name, plan.version, info)] = str(snapshot["id"])
+                    drain(False)
+
+                while pending:
+                    drain(True)
+    finally:
+        output.close()
+        progress.report()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+"""Offline benchmark for the card renderer
+
+Renders synthetic members with every design and reports per-stage latency percentiles, throughput and peak RSS.
+No Discord connection or config.py is needed.
+
+    python bench.py
+    python bench.py --designs default --iterations 50 --cold
+    python bench.py --engines pil numpy
+
+With more than one engine, every engine's cards are also compared pixel by pixel against the first one's.
+"""
+import argparse
+import io
+import json
+import random
+import resource
+import string
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Type
+
+from PIL import Image, ImageChops
+
+from Designs.key import ROLE_PERMS
+from Objects.AssetCache import ASSET_CACHE
+from Objects.AvatarCache import AVATAR_CACHE
+from Objects.CardImage import CardImage, ENGINES, LAYER_CACHE, card_class
+from Objects.RenderPlan import RenderPlan, compile_design
+
+YEARS = ["2018", "2019", "2020", "2021", "2022", "2023"]
+STAGES = ["load", "perm", "text", "image", "group", "layers", "encode", "total"]
+
+
+def role_ids(keys: List[str]) -> List[int]:
+    ids = []
+    for k in keys:
+        r = ROLE_PERMS[k]
+        ids.append(r if isinstance(r, int) else r[0])
+    return ids
+
+
+def role_sets() -> Dict[str, List[int]]:
+    badges = [k for k in ROLE_PERMS if k not in YEARS]
+    return {
+        "none": [],
+        "badges": role_ids(badges),
+        "years": role_ids(YEARS),
+        "all": role_ids(list(ROLE_PERMS))
+    }
+
+
+def synthetic_avatar(size: int, seed: int) -> bytes:
+    rng = random.Random(seed)
+    image = Image.radial_gradient("L").resize((size, size))
+    image = Image.merge("RGB", (image, image.rotate(90), Image.new("L", (size, size), rng.randrange(256))))
+    buffer = io.BytesIO()
+    image.save(buffer, format="png")
+    return buffer.getvalue()
+
+
+def synthetic_members(avatar_sizes: List[int]) -> List[Dict[str, Any]]:
+    names = {
+        "short": "blurple",
+        "long": "W" * 32,
+        "random": "".join(random.Random(0).choices(string.ascii_letters + string.digits, k=24))
+    }
+    avatars = {s: synthetic_avatar(s, s) for s in avatar_sizes}
+
+    members = []
+    for roles_name, roles in role_sets().items():
+        for name_kind, name in names.items():
+            for size, avatar in avatars.items():
+                members.append({
+                    "USERNAME": name,
+                    "DISCRIMINATOR": "0001",
+                    "NICKNAME": name[::-1] if name_kind != "short" else "",
+                    "AVATAR": avatar,
+                    "AVATAR_KEY": f"bench-{size}",
+                    "ROLES": roles,
+                    "JOINED": datetime(2018 + size % 6, 1 + size % 12, 1 + size % 28),
+                    "LABEL": f"{roles_name}/{name_kind}/{size}px"
+                })
+    return members
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def clear_caches():
+    ASSET_CACHE.clear()
+    AVATAR_CACHE.clear()
+    LAYER_CACHE.clear()
+
+
+def bench_design(file: str, members: List[Dict[str, Any]], iterations: int, warmup: int, cold: bool,
+                 engine: str = "pil") -> Dict[str, Any]:
+    card: Type[CardImage] = card_class(engine)
+    samples: Dict[str, List[float]] = {s: [] for s in STAGES}
+
+    plan: RenderPlan = None
+    for _ in range(max(1, iterations // 10)):
+        start = time.perf_counter()
+        plan = compile_design(f"Designs/{file}.json", "Designs")
+        samples["load"].append(time.perf_counter() - start)
+
+    for _ in range(warmup):
+        for mem in members:
+            card(mem).imager(plan)
+
+    renders = 0
+    wall = time.perf_counter()
+    for _ in range(iterations):
+        for mem in members:
+            if cold:
+                clear_caches()
+
+            stages: Dict[str, float] = {}
+            start = time.perf_counter()
+            plan.visible(mem["ROLES"])
+            stages["perm"] = time.perf_counter() - start
+
+            card(mem, stages=stages).imager(plan)
+            stages["total"] = time.perf_counter() - start
+
+            for stage in STAGES[1:]:
+                samples[stage].append(stages.get(stage, 0.0))
+            renders += 1
+    wall = time.perf_counter() - wall
+
+    return {
+        "design": plan.name,
+        "engine": engine,
+        "renders": renders,
+        "throughput": renders / wall if wall else 0.0,
+        "stages": {
+            stage: {p: percentile(v, q) * 1000 for p, q in (("p50", .5), ("p95", .95), ("p99", .99))}
+            for stage, v in samples.items()
+        }
+    }
+
+
+def compare(file: str, members: List[Dict[str, Any]], engines: List[str]) -> Dict[str, Dict[str, int]]:
+    """Largest channel difference from the first engine's cards, where both are opaque, and the number of
+    partly transparent pixels that differ by more than 2, where blending onto transparency can round differently"""
+    plan = compile_design(f"Designs/{file}.json", "Designs")
+    reference = [Image.open(card_class(engines[0])(mem).imager(plan)).convert("RGBA") for mem in members]
+
+    diffs = {}
+    for engine in engines[1:]:
+        opaque, edges = 0, 0
+        for mem, a in zip(members, reference):
+            b = Image.open(card_class(engine)(mem).imager(plan)).convert("RGBA")
+            diff = ImageChops.difference(a, b)
+            solid = ImageChops.multiply(a.getchannel("A").point(lambda v: 255 if v == 255 else 0),
+                                        b.getchannel("A").point(lambda v: 255 if v == 255 else 0))
+            worst = ImageChops.lighter(ImageChops.lighter(diff.getchannel("R"), diff.getchannel("G")),
+                                       ImageChops.lighter(diff.getchannel("B"), diff.getchannel("A")))
+            opaque = max(opaque, ImageChops.multiply(worst, solid).getextrema()[1])
+            edges += ImageChops.subtract(worst, solid).point(lambda v: 255 if v > 2 else 0).histogram()[255]
+        diffs[engine] = {"opaque_max_diff": opaque, "edge_pixels_over_2": edges}
+    return diffs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark CardImage rendering with synthetic members")
+    parser.add_argument("--designs", nargs="+", default=["default", "test"], help="design files in Designs/")
+    parser.add_argument("--iterations", type=int, default=20, help="passes over the synthetic members")
+    parser.add_argument("--warmup", type=int, default=1, help="untimed passes before measuring")
+    parser.add_argument("--avatar-sizes", nargs="+", type=int, default=[64, 256, 1024])
+    parser.add_argument("--cold", action="store_true", help="clear the asset, avatar and layer caches every render")
+    parser.add_argument("--engines", nargs="+", default=["pil"], choices=ENGINES, help="compositing engines")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    members = synthetic_members(args.avatar_sizes)
+    results = [bench_design(d, members, args.iterations, args.warmup, args.cold, e)
+               for d in args.designs for e in args.engines]
+    diffs = {d: compare(d, members, args.engines) for d in args.designs} if len(args.engines) > 1 else {}
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    if args.json:
+        print(json.dumps({"results": results, "diffs": diffs, "peak_rss_mb": peak_rss}, indent=2))
+        return
+
+    for r in results:
+        print(f"{r['design']} ({r['engine']}): {r['renders']} renders, {r['throughput']:.1f} renders/s")
+        print(f"  {'stage':<8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+        for stage, p in r["stages"].items():
+            print(f"  {stage:<8}{p['p50']:>10.2f}{p['p95']:>10.2f}{p['p99']:>10.2f}")
+    for design, engines in diffs.items():
+        for engine, d in engines.items():
+            print(f"{design}: {engine} vs {args.engines[0]}: max difference {d['opaque_max_diff']} on opaque pixels, "
+                  f"{d['edge_pixels_over_2']} partly transparent pixels differ by more than 2")
+    print(f"peak RSS: {peak_rss:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,31 @@
+"""Builds design bundles
+
+A bundle holds a design's compiled object tree, its fonts and every image already decoded and fitted, in one file
+next to the JSON. Renderers map it into memory instead of decoding the loose files, so startup is faster and process
+workers share one copy of the pixels. Designs without an up to date bundle load from the loose files as before.
+
+    python bundle.py default test
+"""
+import argparse
+import os
+import time
+
+from Objects.Bundle import Bundle, build_bundle
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build mmap-able bundles of designs and their assets")
+    parser.add_argument("designs", nargs="+", help="design files in Designs/, without .json")
+    args = parser.parse_args()
+
+    for name in args.designs:
+        start = time.perf_counter()
+        path = build_bundle(f"Designs/{name}.json", "Designs")
+        bundle = Bundle(path)
+        print(f"{path}: {os.path.getsize(path) / 1024 / 1024:.1f} MB, {len(bundle.index['images'])} images, "
+              f"{len(bundle.index['masks'])} masks, {len(bundle.index['fonts'])} fonts, "
+              f"built in {time.perf_counter() - start:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
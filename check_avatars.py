@@ -0,0 +1,78 @@
+"""Regression check for avatar fetch coalescing
+
+Starts many concurrent AvatarCache.fetch calls for one avatar against a stub CDN read and checks that the CDN was
+asked once and every caller got the same bytes, then that a failed read reaches every waiter and isn't cached.
+
+    python check_avatars.py
+
+Exits with status 1 on the first failure. No Discord connection or config.py is needed.
+"""
+import asyncio
+import sys
+
+from Objects.AvatarCache import AvatarCache
+
+CALLERS = 50
+
+
+class StubCDN:
+    """Stands in for bot.http.get_from_cdn, counting reads"""
+
+    def __init__(self, data: bytes, fail: bool = False):
+        self.data: bytes = data
+        self.fail: bool = fail
+        self.reads: int = 0
+
+    async def read(self) -> bytes:
+        self.reads += 1
+        # long enough for every caller to arrive while the read is in flight
+        await asyncio.sleep(0.05)
+        if self.fail:
+            raise ConnectionError("CDN unavailable")
+        return self.data
+
+
+def fail(message: str):
+    print(message)
+    sys.exit(1)
+
+
+async def check():
+    cache = AvatarCache(1024 * 1024)
+
+    cdn = StubCDN(b"avatar bytes")
+    results = await asyncio.gather(*[cache.fetch("a_1234", cdn.read) for _ in range(CALLERS)])
+    if cdn.reads != 1:
+        fail(f"{CALLERS} concurrent fetches read the CDN {cdn.reads} times")
+    if any(r != cdn.data for r in results):
+        fail("concurrent fetches returned different bytes")
+    if cache.coalesced != CALLERS - 1:
+        fail(f"expected {CALLERS - 1} coalesced fetches, counted {cache.coalesced}")
+
+    await cache.fetch("a_1234", cdn.read)
+    if cdn.reads != 1:
+        fail("a cached avatar was read from the CDN again")
+
+    broken = StubCDN(b"", fail=True)
+    results = await asyncio.gather(*[cache.fetch("b_5678", broken.read) for _ in range(CALLERS)],
+                                   return_exceptions=True)
+    reached = sum(isinstance(r, ConnectionError) for r in results)
+    if broken.reads != 1 or reached != CALLERS:
+        fail(f"a failed read was tried {broken.reads} times and reached {reached} of {CALLERS} callers")
+    if cache.inflight:
+        fail("a failed read was left in flight")
+
+    broken.fail = False
+    broken.data = b"second try"
+    if await cache.fetch("b_5678", broken.read) != b"second try":
+        fail("a failed read was cached")
+
+    print(f"{CALLERS} concurrent fetches shared one CDN read, failures reached every caller and weren't cached")
+
+
+def main():
+    asyncio.run(check())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""Regression check for compiled group layouts
+
+Loads a design with a group inside a group and, for every combination of the roles it uses, compares
+DesignGroup.layout against the per-render layout it replaced: where each visible object lands, and the rendered
+card against one with every object placed at those positions by hand.
+
+    python check_layout.py
+
+Exits with status 1 on the first difference. No Discord connection or config.py is needed.
+"""
+import copy
+import json
+import os
+import sys
+import tempfile
+from statistics import mean
+from typing import List, Tuple
+
+from PIL import ImageChops, Image
+
+from Objects.CardImage import CardImage, text_anchor
+from Objects.Design import Design, load_design_from_json
+from Objects.DesignGroup import DesignGroup
+from Objects.DesignObj import DesignObj
+from Objects.RenderPlan import RenderPlan
+
+NESTED = {
+    "info": {"name": "Nested", "folder_path": "default"},
+    "fonts": {"B": "SourceSansPro-Bold.ttf"},
+    "colors": {"white": [255, 255, 255, 255]},
+    "objects": {
+        "groups": [
+            {"name": "Outer", "pos": [640, 400], "anchor": "", "queue": [[0, 0], [200, 0], [400, 0, 0], [600, 50]]},
+            {"name": "Years", "group": "Outer", "group_layer": 1, "anchor": "L",
+             "queue": [[0, 0, 2], [40, 10, 1], [80, 20, 0]]},
+            {"name": "Staff", "group": "Years", "roles": ["STAFF"], "queue": [[0, 0], [0, 60]]}
+        ],
+        "text": [
+            {"text": "{USERNAME}", "font": "B", "size": 40, "color": "white", "group": "Outer", "group_layer": 0}
+        ],
+        "images": [
+            {"image": "CARD_DARK.png", "layer": 1},
+            {"image": "ARTISTS.png", "group": "Outer", "group_layer": 2, "roles": ["ARTIST"], "max_width": 120},
+            {"image": "ICON_18.png", "group": "Years", "group_layer": 0, "roles": ["2018"], "max_width": 90},
+            {"image": "ICON_19.png", "group": "Years", "group_layer": 1, "roles": ["~2019"], "max_width": 90},
+            {"image": "MODERATOR.png", "group": "Staff", "group_layer": 0, "max_width": 80},
+            {"image": "REP.png", "group": "Staff", "group_layer": 1, "roles": ["SERVER_REP"], "max_width": 80}
+        ]
+    }
+}
+
+Placed = List[Tuple[DesignObj, Tuple[int, int], str]]
+
+
+def reference(group: DesignGroup, pos: Tuple[int, int], bits: int) -> Placed:
+    """The layout paste_group used to work out on every render, recursing into nested groups"""
+    contents = [c for c in group.contents if c.visible(bits)]
+    gx, gy = pos
+    slots = group.queue[:len(contents)]
+    if contents:
+        a = text_anchor(group.anchor)
+        if not any(c in a for c in "lr"):
+            gx -= int(mean(s[0] for s in slots))
+        if not any(c in a for c in "ad"):
+            gy -= int(mean(s[1] for s in slots))
+
+    placed = sorted(((obj, (gx + s[0], gy + s[1]), s[2] if len(s) == 3 else -1) for obj, s in zip(contents, slots)),
+                    key=lambda p: p[2])
+    leaves = []
+    for obj, xy, _ in placed:
+        if isinstance(obj, DesignGroup):
+            leaves += reference(obj, xy, bits)
+        else:
+            leaves.append((obj, xy, group.anchor))
+    return leaves
+
+
+def compiled(group: DesignGroup, pos: Tuple[int, int], bits: int) -> Placed:
+    leaves = []
+    for obj, xy, _ in group.layout(pos, [c for c in group.contents if c.visible(bits)]):
+        if isinstance(obj, DesignGroup):
+            leaves += compiled(obj, xy, bits)
+        else:
+            leaves.append((obj, xy, group.anchor))
+    return leaves
+
+
+def flat_plan(plan: RenderPlan, bits: int) -> RenderPlan:
+    """The plan with every visible object placed where the reference layout puts it, and no groups"""
+    flat = Design(name=f"{plan.name} flat", folder_path=plan.design.folder_path)
+    flat.font_paths, flat.fonts = plan.design.font_paths, {k: {} for k in plan.design.font_paths}
+    for i in plan.items:
+        if not i.visible(bits):
+            continue
+        for obj, xy, anchor in (reference(i, i.pos, bits) if isinstance(i, DesignGroup) else [(i, i.pos, i.anchor)]):
+            obj = copy.copy(obj)
+            obj.pos, obj.anchor, obj.layer = xy, anchor, i.layer
+            obj.need_bits = obj.forbid_bits = 0
+            flat.items.append(obj)
+    return RenderPlan(flat)
+
+
+def main():
+    with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as f:
+        json.dump(NESTED, f)
+    try:
+        plan = RenderPlan(load_design_from_json(f.name, "Designs"))
+    finally:
+        os.unlink(f.name)
+
+    keys = [b for b in (1 << n for n in range(plan.role_mask.bit_length())) if plan.role_mask & b]
+    mem = {"USERNAME": "blurple", "AVATAR": None}
+    for n in range(1 << len(keys)):
+        bits = sum(b for k, b in enumerate(keys) if n >> k & 1)
+        for i in plan.items:
+            if isinstance(i, DesignGroup) and i.visible(bits):
+                expected, got = reference(i, i.pos, bits), compiled(i, i.pos, bits)
+                expected = [(getattr(o, "image", None) or o.text, xy) for o, xy, _ in expected]
+                got = [(getattr(o, "image", None) or o.text, xy) for o, xy, _ in got]
+                if expected != got:
+                    print(f"group {i.name} with role bits {bits:#x}: expected {expected}, got {got}")
+                    sys.exit(1)
+
+        card = Image.open(CardImage({**mem, "ROLE_BITS": bits}).imager(plan))
+        flat = Image.open(CardImage({**mem, "ROLE_BITS": bits}).imager(flat_plan(plan, bits)))
+        if ImageChops.difference(card.convert("RGBA"), flat.convert("RGBA")).getbbox() is not None:
+            print(f"card with role bits {bits:#x} differs from the reference layout")
+            sys.exit(1)
+
+    print(f"{plan.name}: compiled layouts match for {1 << len(keys)} role combinations")
+
+
+if __name__ == "__main__":
+    main()
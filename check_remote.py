@@ -0,0 +1,78 @@
+"""Regression check for rendering through render_server.py
+
+Starts a RenderServer in this process on a free local port, renders a card through RemoteRenderer and compares it
+with the same card rendered locally, then checks that a request for a design version the server hasn't compiled is
+refused instead of rendered.
+
+    python check_remote.py
+
+Exits with status 1 on the first failure. Needs aiohttp, but no Discord connection or config.py.
+"""
+import asyncio
+import copy
+import sys
+from datetime import datetime
+
+from Objects.CardImage import CardImage
+from Objects.DesignWatcher import DesignWatcher
+from Objects.RemoteRender import RemoteRenderer, RenderServerError
+from Objects.RenderBackend import RenderBackend
+from Objects.RenderPlan import DesignStore
+from Objects.RenderScheduler import RenderScheduler
+from render_server import RenderServer
+
+MEMBER = {"USERNAME": "blurple", "DISCRIMINATOR": "0001", "NICKNAME": "Blurple", "AVATAR": None, "AVATAR_KEY": None,
+          "ROLES": [], "JOINED": datetime(2021, 5, 1)}
+
+
+def fail(message: str):
+    print(message)
+    sys.exit(1)
+
+
+async def check():
+    store = DesignStore(["default"], "Designs")
+    store.load_all()
+    plan = store["Default"]
+
+    backend = RenderBackend("inline")
+    backend.start(store)
+    scheduler = RenderScheduler(backend)
+    scheduler.start()
+    server = RenderServer(store, scheduler, DesignWatcher(store))
+    tcp = await asyncio.start_server(server.connection, "127.0.0.1", 0)
+    port = tcp.sockets[0].getsockname()[1]
+
+    remote = RemoteRenderer([f"http://127.0.0.1:{port}"], retries=0)
+    try:
+        data = (await remote.render(plan, dict(MEMBER))).getvalue()
+        if data != CardImage(dict(MEMBER)).imager(plan).getvalue():
+            fail("the card rendered through the server differs from the one rendered locally")
+
+        stale = copy.copy(plan)
+        stale.version = "0" * len(plan.version)
+        try:
+            await remote.render(stale, dict(MEMBER))
+        except RenderServerError as e:
+            if "409" not in str(e):
+                fail(f"a stale version was refused for the wrong reason: {e}")
+        else:
+            fail(f"the server rendered version {plan.version} for a request for {stale.version}")
+    finally:
+        remote.shutdown()
+        tcp.close()
+        await tcp.wait_closed()
+        await scheduler.stop()
+        backend.shutdown()
+        # lets the client session finish closing
+        await asyncio.sleep(0.1)
+
+    print(f"{plan.name}: remote render matches the local one, other versions are refused")
+
+
+def main():
+    asyncio.run(check())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,5 @@
+TOKEN = "x"
+BOT_PREFIX = "!"
+DESIGNS = ["default", "test"]
+DEFAULT = "Default"
+ASSET_CACHE_MB = 256
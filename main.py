@@ -1,8 +1,16 @@
+import time
+
+STARTED = time.perf_counter()
+
+import asyncio
+
 import discord
 from discord.ext import commands
 
 from config import *
 
+IMPORTED = time.perf_counter()
+
 
 class BlurpleProfile(commands.Bot):
     async def setup_hook(self):
@@ -11,15 +19,43 @@ class BlurpleProfile(commands.Bot):
             'profile'
         ]
 
+        timings = {"imports": IMPORTED - STARTED}
         for extension in initial_extensions:
+            start = time.perf_counter()
             await bot.load_extension(extension)
-
-
-intents = discord.Intents.all()
+            timings[extension] = time.perf_counter() - start
+
+        self.tasks["startup_report"] = asyncio.create_task(self.report_startup(timings))
+
+    async def report_startup(self, timings):
+        """Prints how long each startup stage took, once the profile cog has finished warming up"""
+        profile = self.get_cog("Profile")
+        if profile is not None and profile.warmup is not None:
+            try:
+                await asyncio.shield(profile.warmup)
+            except Exception as e:
+                print(f"Profile warm-up failed: {type(e).__name__}: {e}")
+                return
+        if profile is not None:
+            timings.update({f"profile {k}": v for k, v in profile.startup.items() if k != "ready"})
+
+        stages = ", ".join(f"{k} {v * 1000:.0f}ms" for k, v in timings.items())
+        print(f"Ready {time.perf_counter() - STARTED:.2f}s after starting ({stages})")
+
+
+# members aren't cached, the profile cog keeps a compact index of the main guild's members instead, read from
+# member chunks and raw gateway events
+intents = discord.Intents.none()
+intents.guilds = True
+intents.members = True
+intents.guild_messages = True
+intents.message_content = True
 
 description = "Blurple Profile"
 get_pre = lambda bot, message: BOT_PREFIX
-bot = BlurpleProfile(command_prefix=get_pre, description=description, intents=intents)
+bot = BlurpleProfile(command_prefix=get_pre, description=description, intents=intents,
+                     member_cache_flags=discord.MemberCacheFlags.none(), chunk_guilds_at_startup=False,
+                     enable_debug_events=True)
 
 bot.recent_cog = None
 
@@ -46,4 +82,6 @@ async def globally_block_dms(ctx):
     return ctx.guild is not None
 
 
-bot.run(TOKEN, reconnect=True)
+# process pool render workers are spawned and re-import this module, they must not start the bot
+if __name__ == "__main__":
+    bot.run(TOKEN, reconnect=True)
@@ -1,3 +1,5 @@
+import io
+import json
 import sys
 import traceback
 from typing import *
@@ -7,6 +9,8 @@ from discord.ext import commands
 from discord.ext.commands import *
 from discord.client import _log
 
+from Objects.Metrics import METRICS
+
 
 class OwnerCog(commands.Cog, name="Owner"):
     """Owner commands"""
@@ -31,6 +35,23 @@ class OwnerCog(commands.Cog, name="Owner"):
 
         await self.bot.close()
 
+    @commands.command()
+    async def metrics(self, ctx):
+        """Sends render metrics as JSON"""
+        data = json.dumps(METRICS.dump(), indent=2).encode()
+        await ctx.send(file=discord.File(io.BytesIO(data), filename="metrics.json"))
+
+    @commands.command()
+    async def designs(self, ctx):
+        """Lists the live design versions and any rejected edits"""
+        profile = self.bot.get_cog("Profile")
+        if profile is not None and not profile.ready.is_set():
+            return await ctx.send("Designs are still loading.")
+        lines = [f"`{p.name}` {p.version[:8]}" for p in self.bot.design_store.plans.values()]
+        for file, error in self.bot.design_watcher.errors.items():
+            lines.append(f"**Rejected edit to `{file}`:** {error}")
+        await ctx.send("\n".join(lines))
+
     @commands.group(name="cogs", aliases=["cog"])
     async def cogs(self, ctx):
         """Cog management"""
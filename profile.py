@@ -1,191 +1,57 @@
+import asyncio
 import io
-from copy import copy
-from datetime import datetime
+import json
+import logging
+import time
 from functools import partial
-from statistics import mean
-from typing import Any, Dict, Optional, List
+from typing import Dict, Literal, Optional
 
 import discord
-from discord import *
-from discord.ext.commands import *
-from discord.app_commands import *
+from discord import Guild, Interaction, app_commands
+from discord.app_commands import AppCommandError
 from discord.app_commands.tree import _log
-
-from PIL import Image, ImageDraw
-
-from Designs.key import ROLE_PERMS, MAIN_GUILD
-from Objects.Design import load_design_from_json, Design
-from Objects.DesignGroup import DesignGroup
-from Objects.DesignImage import DesignImage
-from Objects.DesignObj import DesignObj
-from Objects.DesignText import DesignText
+from discord.ext.commands import Bot, Cog
+
+import config
+from Designs.key import MAIN_GUILD
+from Objects.AssetCache import ASSET_CACHE
+from Objects.AvatarCache import AVATAR_CACHE
+from Objects.CardImage import LAYER_CACHE, SIZES, card_class
+from Objects.DesignWatcher import DesignWatcher, check
+from Objects.DiskCache import DiskCache
+from Objects.Encoder import ENCODE_STATS, FORMATS, extension
+from Objects.MemberIndex import MemberIndex, MemberRecord
+from Objects.Metrics import METRICS, MetricsServer
+from Objects.RenderBackend import RenderBackend, RenderBusy
+from Objects.RenderPlan import DesignStore
+from Objects.RenderScheduler import RenderScheduler
+from Objects.ResultCache import RESULT_CACHE, card_key
 from config import DESIGNS, DEFAULT
 
-
-def size_anchor(pos, size, anchor):
-    px, py = pos
-    sx, sy = size
-
-    if "R" in anchor:
-        px -= sx
-    elif "L" not in anchor:
-        px -= sx / 2
-
-    if any(i in anchor for i in ["D", "B"]):
-        py -= sy
-    elif all(i not in anchor for i in ["T", "U"]):
-        py -= sy / 2
-
-    return round(px), round(py)
-
-
-def text_anchor(anchor):
-    parts = list(anchor)
-    new = []
-
-    if "L" in parts:
-        new.append("l")
-    elif "R" in parts:
-        new.append("r")
-    else:
-        new.append("m")
-
-    if any(i in parts for i in ["U", "T"]):
-        new.append("a")
-    elif any(i in parts for i in ["D", "B"]):
-        new.append("d")
-    else:
-        new.append("m")
-
-    return "".join(new)
-
-
-class CardImage:
-    def __init__(self, mem: Optional[Dict[str, Any]] = None):
-        self.size = (1280, 833)
-        self.bg = (0, 0, 0, 0)
-        self.mem = mem
-
-    def imager(self, design: Design, *, timer=False):
-        if timer:
-            start = datetime.now()
-
-        card = Image.new('RGBA', self.size, self.bg)
-        draw = ImageDraw.Draw(card)
-
-        for i in design.items:
-            if not self.perm_check(i):
-                continue
-
-            self.paste_object(card, draw, design, i)
-
-        image_file_object = io.BytesIO()
-        card.save(image_file_object, format='png')
-        image_file_object.seek(0)
-
-        if timer:
-            print(f"{round((datetime.now() - start).total_seconds(), 2)}s")
-
-        return image_file_object
-
-    def perm_check(self, i: DesignObj):
-        return not i.roles or all(self.role_perm_check(r) for r in i.roles)
-
-    def role_perm_check(self, r: str):
-        neg = r.startswith("~")
-        r = r.lstrip("~")
-
-        roles = ROLE_PERMS[r]
-        if isinstance(roles, int):
-            return roles in self.mem["ROLES"] != neg
-        else:
-            return any(rr in self.mem["ROLES"] for rr in roles) != neg
-
-    def paste_object(self, card: Image, draw: ImageDraw, design: Design, i: DesignObj):
-        if isinstance(i, DesignGroup):
-            self.paste_group(card, draw, design, i)
-
-        elif isinstance(i, DesignText):
-            self.paste_text(draw, design, i)
-
-        elif isinstance(i, DesignImage):
-            self.paste_image(card, design, i)
-
-    def paste_text(self, draw: ImageDraw, design: Design, i: DesignText):
-        font = design.get_font(i.font, i.size)
-        text = i.text.format(**self.mem)
-        if i.max_width:
-            length = font.getlength(text)
-            if length > i.max_width:
-                i.size = round(i.size * i.max_width / length)
-                font = design.get_font(i.font, i.size)
-
-        # xy = size_anchor(i.pos, ts, i.anchor)
-        draw.text(xy=i.pos, anchor=text_anchor(i.anchor), text=text, font=font, fill=i.color)
-
-    def paste_image(self, card: Image, design: Design, i: DesignImage):
-        if i.image == "PFP":
-            if not self.mem['AVATAR']:
-                return
-            image = Image.open(io.BytesIO(self.mem['AVATAR']))
-            maxsize = max(m if m else 0 for m in [i.max_width, i.max_height])
-            if image.size[0] < maxsize:
-                image = image.resize((maxsize, maxsize))
-        else:
-            image = Image.open(design.path(i))
-
-        image = image.convert("RGBA")
-
-        size = copy(image.size)
-        if i.max_width or i.max_height:
-            if i.max_width and i.max_width < size[0]:
-                size = (i.max_width, size[1] * i.max_width / size[0])
-            if i.max_height and i.max_height < size[1]:
-                size = (size[0] * i.max_height / size[1], i.max_height)
-            size = (round(size[0]), round(size[1]))
-
-            image = image.resize(size)
-
-        if i.mask:
-            mask = Image.open(design.path(i.mask)).convert("RGBA")
-        else:
-            mask = image
-
-        xy = size_anchor(i.pos, size, i.anchor)
-        card.paste(image.convert("RGB"), xy, mask)
-
-    def paste_group(self, card: Image, draw: ImageDraw, design: Design, i: DesignGroup):
-        queue = copy(i.queue)
-        gx, gy = i.pos
-        final = []
-
-        contents = [c for c in i.contents if self.perm_check(c)]
-
-        if contents:
-            a = text_anchor(i.anchor)
-            poss = queue[:len(contents)]
-            span = [mean(i[0] for i in poss), mean(i[1] for i in poss)]
-            if not any(i in a for i in ['l', 'r']):
-                gx -= int(span[0])
-            if not any(i in a for i in ['a', 'd']):
-                gy -= int(span[1])
-
-            for obj in contents:
-                try:
-                    xyz = queue.pop(0)
-                    obj.pos = (gx + xyz[0], gy + xyz[1])
-                    obj.layer = xyz[2] if len(xyz) == 3 else -1
-                    obj.anchor = i.anchor
-                except IndexError as e:
-                    print("Not enough positions in the queue for all the group items")
-                    raise e
-
-                final.append(obj)
-
-            final.sort(key=lambda x: x.layer)
-
-            for obj in final:
-                self.paste_object(card, draw, design, obj)
+ASSET_CACHE_MB = getattr(config, "ASSET_CACHE_MB", 256)
+LAYER_CACHE_MB = getattr(config, "LAYER_CACHE_MB", 64)
+AVATAR_CACHE_MB = getattr(config, "AVATAR_CACHE_MB", 128)
+RESULT_CACHE_MB = getattr(config, "RESULT_CACHE_MB", 64)
+RESULT_CACHE_TTL = getattr(config, "RESULT_CACHE_TTL", 3600)
+DISK_CACHE_DIR = getattr(config, "DISK_CACHE_DIR", None)
+DISK_CACHE_MB = getattr(config, "DISK_CACHE_MB", 1024)
+RENDER_BACKEND = getattr(config, "RENDER_BACKEND", "thread")
+RENDER_WORKERS = getattr(config, "RENDER_WORKERS", None)
+RENDER_QUEUE = getattr(config, "RENDER_QUEUE", 64)
+RENDER_ENGINE = getattr(config, "RENDER_ENGINE", "pil")
+RENDER_ENDPOINTS = getattr(config, "RENDER_ENDPOINTS", [])
+RENDER_TIMEOUT = getattr(config, "RENDER_TIMEOUT", 10)
+DESIGN_WATCH_INTERVAL = getattr(config, "DESIGN_WATCH_INTERVAL", 1.0)
+PRERENDER = getattr(config, "PRERENDER", False)
+PRERENDER_DELAY = getattr(config, "PRERENDER_DELAY", 5.0)
+PRERENDER_RATE = getattr(config, "PRERENDER_RATE", 2.0)
+PRERENDER_BURST = getattr(config, "PRERENDER_BURST", 10)
+PRERENDER_ACTIVE = getattr(config, "PRERENDER_ACTIVE", 86400)
+METRICS_PORT = getattr(config, "METRICS_PORT", None)
+METRICS_SAMPLE_RATE = getattr(config, "METRICS_SAMPLE_RATE", 0.1)
+BACKGROUND_WARMUP = getattr(config, "BACKGROUND_WARMUP", True)
+
+log = logging.getLogger(__name__)
 
 
 class ProfileCog(Cog, name="Profile"):
@@ -196,13 +62,190 @@ class ProfileCog(Cog, name="Profile"):
 
         self.bot.tree.on_error = self.on_app_command_error
 
-        self.bot.designs = {}
+        ASSET_CACHE.resize(ASSET_CACHE_MB * 1024 * 1024)
+        LAYER_CACHE.resize(LAYER_CACHE_MB * 1024 * 1024)
+        AVATAR_CACHE.resize(AVATAR_CACHE_MB * 1024 * 1024)
+        RESULT_CACHE.resize(RESULT_CACHE_MB * 1024 * 1024)
+        RESULT_CACHE.ttl = RESULT_CACHE_TTL
+
+        self.disk_cache = DiskCache(DISK_CACHE_DIR, DISK_CACHE_MB * 1024 * 1024) if DISK_CACHE_DIR else None
+        RESULT_CACHE.disk = self.disk_cache
+        AVATAR_CACHE.disk = self.disk_cache
+
+        # kept across cog reloads, on_guild_available doesn't fire again to refill a new one
+        if getattr(self.bot, "member_index", None) is None or self.bot.member_index.guild_id != MAIN_GUILD:
+            self.bot.member_index = MemberIndex(MAIN_GUILD)
+        self.chunking: Optional[asyncio.Task] = None
+
+        self.bot.design_store = DesignStore(DESIGNS, "Designs")
+        self.bot.designs = self.bot.design_store.plans
+        self.bot.design_watcher = DesignWatcher(self.bot.design_store, interval=DESIGN_WATCH_INTERVAL or 1.0,
+                                                engine=RENDER_ENGINE)
+
+        if RENDER_ENDPOINTS:
+            from Objects.RemoteRender import RemoteRenderer
+            self.bot.render_backend = RemoteRenderer(RENDER_ENDPOINTS, workers=RENDER_WORKERS or 8,
+                                                     timeout=RENDER_TIMEOUT)
+        else:
+            self.bot.render_backend = RenderBackend(RENDER_BACKEND, workers=RENDER_WORKERS, engine=RENDER_ENGINE,
+                                                disk_cache=self.disk_cache)
+        self.bot.render_scheduler = RenderScheduler(self.bot.render_backend, max_queue=RENDER_QUEUE)
+
+        self.prerenderer = None
+        if PRERENDER:
+            from Objects.PreRender import PreRenderer
+            self.prerenderer = PreRenderer(self.prerender, delay=PRERENDER_DELAY, rate=PRERENDER_RATE,
+                                           burst=PRERENDER_BURST, active=PRERENDER_ACTIVE)
+
+        METRICS.sample_rate = METRICS_SAMPLE_RATE
+        self.register_gauges()
+        self.metrics_server = MetricsServer(METRICS, port=METRICS_PORT) if METRICS_PORT else None
+
+        # set once designs are compiled and warm, /profile waits for it
+        self.ready = asyncio.Event()
+        self.warmup: Optional[asyncio.Task] = None
+        # set by cog_unload, the warm-up thread can't be cancelled and checks it between stages instead
+        self.unloading: bool = False
+        # seconds each startup stage took
+        self.startup: Dict[str, float] = {}
+        self.created = time.perf_counter()
+        if not BACKGROUND_WARMUP:
+            self.warm_up()
+            self.ready.set()
+
+    async def cog_load(self):
+        self.bot.render_scheduler.start()
+        if self.prerenderer:
+            self.prerenderer.start()
+        if self.metrics_server:
+            await self.metrics_server.start()
+        if BACKGROUND_WARMUP:
+            self.warmup = asyncio.create_task(self.warm_up_in_background())
+        elif DESIGN_WATCH_INTERVAL:
+            self.bot.design_watcher.start()
+
+        # reloaded while connected: catch up on member events sent while the cog wasn't listening
+        guild = self.bot.get_guild(MAIN_GUILD)
+        if guild is not None and not guild.unavailable:
+            self.chunking = asyncio.create_task(self.on_guild_available(guild))
+
+    async def warm_up_in_background(self):
+        try:
+            await asyncio.to_thread(self.warm_up)
+        except Exception:
+            log.exception("Loading designs failed, /profile is unavailable until the cog is reloaded")
+            raise
+        if self.unloading:
+            return
+        self.ready.set()
+        # started afterwards, it would otherwise compile the designs that haven't loaded yet a second time
+        if DESIGN_WATCH_INTERVAL:
+            self.bot.design_watcher.start()
+
+    def warm_up(self):
+        """Compiles the designs, starts the render backend and renders trial cards with every design in this
+        process, so the first /profile finds fonts, assets and static layers loaded"""
+        start = time.perf_counter()
         self.load_designs()
+        self.startup["designs"] = time.perf_counter() - start
+
+        if self.unloading:
+            return
+        start = time.perf_counter()
+        self.bot.render_backend.start(self.bot.design_store)
+        self.startup["backend"] = time.perf_counter() - start
+
+        # process pool workers and render servers warm their own caches
+        if isinstance(self.bot.render_backend, RenderBackend) and self.bot.render_backend.kind != "process":
+            start = time.perf_counter()
+            for plan in list(self.bot.design_store.plans.values()):
+                if self.unloading:
+                    return
+                check(plan, card_class(RENDER_ENGINE))
+            self.startup["renders"] = time.perf_counter() - start
+
+        self.startup["ready"] = time.perf_counter() - self.created
+
+    async def cog_unload(self):
+        self.unloading = True
+        if self.warmup is not None:
+            # wait for the warm-up thread to stop, so it can't start the backend after it is shut down below
+            await asyncio.gather(self.warmup, return_exceptions=True)
+        if self.chunking is not None:
+            self.chunking.cancel()
+        if self.prerenderer:
+            await self.prerenderer.stop()
+        await self.bot.design_watcher.stop()
+        await self.bot.render_scheduler.stop()
+        self.bot.render_backend.shutdown()
+        if self.metrics_server:
+            await self.metrics_server.stop()
+
+    def register_gauges(self):
+        for name, cache in [("asset", ASSET_CACHE), ("layer", LAYER_CACHE), ("avatar", AVATAR_CACHE),
+                            ("result", RESULT_CACHE)]:
+            METRICS.gauge("cache_hits", lambda c=cache: c.hits, cache=name)
+            METRICS.gauge("cache_misses", lambda c=cache: c.misses, cache=name)
+            METRICS.gauge("cache_hit_ratio", lambda c=cache: c.hits / max(1, c.hits + c.misses), cache=name)
+            METRICS.gauge("cache_bytes", lambda c=cache: c.bytes, cache=name)
+        if self.disk_cache is not None:
+            disk = self.disk_cache
+            METRICS.gauge("cache_hits", lambda: disk.hits, cache="disk")
+            METRICS.gauge("cache_misses", lambda: disk.misses, cache="disk")
+            METRICS.gauge("cache_hit_ratio", lambda: disk.hits / max(1, disk.hits + disk.misses), cache="disk")
+            METRICS.gauge("cache_bytes", lambda: disk.bytes, cache="disk")
+
+        scheduler = self.bot.render_scheduler
+        METRICS.gauge("render_queue_depth", lambda: scheduler.depth)
+        METRICS.gauge("render_running", lambda: scheduler.running)
+        METRICS.gauge("render_background_depth", lambda: len(scheduler.background))
+        METRICS.gauge("profile_ready", lambda: int(self.ready.is_set()))
+        if self.prerenderer is not None:
+            METRICS.gauge("prerender_pending", lambda: len(self.prerenderer.pending))
+
+        for fmt in FORMATS:
+            METRICS.gauge("encode_bytes", lambda f=fmt: ENCODE_STATS.stats().get(f, {}).get("bytes", 0), format=fmt)
 
     def load_designs(self):
-        for d in DESIGNS:
-            design = load_design_from_json(f"Designs/{d}.json", "Designs")
-            self.bot.designs[design.name] = design
+        self.bot.design_store.load_all()
+
+    @Cog.listener()
+    async def on_guild_available(self, guild: Guild):
+        if guild.id == MAIN_GUILD:
+            self.bot.member_index.load(await guild.chunk(cache=False))
+
+    @Cog.listener()
+    async def on_socket_raw_receive(self, msg):
+        # members aren't cached, so member events are read straight from the gateway into the member index
+        if not isinstance(msg, str) or "GUILD_MEMBER_" not in msg:
+            return
+        payload = json.loads(msg)
+        old, new = self.bot.member_index.apply(payload.get("t"), payload.get("d") or {})
+
+        if self.prerenderer is not None and self.ready.is_set() and old is not None and new is not None:
+            design = self.bot.designs[DEFAULT]
+            # role, nickname and avatar changes that don't show on the card leave its key as it was
+            if card_key(design, old.info()) != card_key(design, new.info()):
+                self.prerenderer.touch(new.id)
+
+    def avatar_reader(self, mem: MemberRecord):
+        return partial(AVATAR_CACHE.fetch, mem.avatar_key, partial(self.bot.http.get_from_cdn,
+                                                                    mem.avatar_url(MAIN_GUILD)))
+
+    async def prerender(self, member_id: int, size: str):
+        """Renders a member's card into the result cache at the size they last asked for"""
+        design = self.bot.designs[DEFAULT]
+        mem = self.bot.member_index.get(member_id)
+        if mem is None:
+            return
+
+        info = mem.info(None if size in (None, "full") else SIZES[size])
+        key = card_key(design, info)
+        if await RESULT_CACHE.get_card(design, key) is not None:
+            return
+        buffer = await self.bot.render_scheduler.submit(design, info, key=key, avatar=self.avatar_reader(mem),
+                                                        background=True)
+        await RESULT_CACHE.put_card(design, key, buffer.getvalue())
 
     async def on_app_command_error(self, interaction: Interaction, error: AppCommandError):
         # if isinstance(error, app_commands.errors.CheckFailure):
@@ -218,16 +261,31 @@ class ProfileCog(Cog, name="Profile"):
         _log.error('Ignoring exception in command %r', interaction.command.name, exc_info=error)
 
     @app_commands.command(name="profile")
-    @app_commands.describe(user="User to view profile")
-    async def profile(self, interaction: discord.Interaction, user: discord.User = None):
+    @app_commands.describe(user="User to view profile", size="Full card, or a smaller one shown in an embed")
+    async def profile(self, interaction: discord.Interaction, user: discord.User = None,
+                      size: Literal["full", "embed", "thumbnail"] = "full"):
         """Your Project Blurple profile card"""
 
         await interaction.response.defer()
+        if not self.ready.is_set():
+            # still loading designs after a restart or reload, raises if that failed
+            await asyncio.shield(self.warmup)
 
-        self.load_designs()
+        sampled = METRICS.sampled()
+        start = time.perf_counter()
+
+        design = self.bot.designs[DEFAULT]
 
         user = interaction.user if user is None else user
-        mem = self.bot.get_guild(MAIN_GUILD).get_member(user.id)
+        mem = self.bot.member_index.get(user.id)
+        if mem is None and not self.bot.member_index.ready:
+            # the main guild's members haven't been chunked yet
+            try:
+                guild = self.bot.get_guild(MAIN_GUILD) or await self.bot.fetch_guild(MAIN_GUILD)
+                mem = MemberRecord.from_member(await guild.fetch_member(user.id))
+            except discord.HTTPException:
+                # NotFound when they aren't a member, other errors get the same answer
+                pass
 
         if not mem:
             if user.id == interaction.user.id:
@@ -236,27 +294,42 @@ class ProfileCog(Cog, name="Profile"):
                 await interaction.followup.send(f"{user.name} hasn't joined the main server!", ephemeral=True)
             return
 
-        # try:
-        #     joined = mem.joined_at.strftime("%#d %B, %Y")
-        # except ValueError:
-        #     joined = mem.joined_at.strftime("%-d %B, %Y")
-        joined = mem.joined_at
+        if self.prerenderer is not None:
+            self.prerenderer.seen(mem.id, size)
 
-        info = {
-            "USERNAME": mem.name,
-            "DISCRIMINATOR": mem.discriminator,
-            "NICKNAME": mem.nick if mem.nick else "",
-            "AVATAR": await mem.display_avatar.read() if mem.display_avatar else None,
-            "ROLES": [i.id for i in mem.roles],
-            "JOINED": joined
-        }
+        info = mem.info(None if size == "full" else SIZES[size])
+        key = card_key(design, info)
+        cached = await RESULT_CACHE.get_card(design, key)
+        METRICS.inc("result_cache_requests", result="miss" if cached is None else "hit")
+        if cached is not None:
+            final_buffer = io.BytesIO(cached)
+        else:
+            try:
+                final_buffer = await self.bot.render_scheduler.submit(design, info, key=key, guild=interaction.guild_id,
+                                                                      user=interaction.user.id,
+                                                                      avatar=self.avatar_reader(mem), sampled=sampled)
+            except RenderBusy:
+                await interaction.followup.send("Lots of profiles are being made right now, try again in a moment!",
+                                                ephemeral=True)
+                return
+            await RESULT_CACHE.put_card(design, key, final_buffer.getvalue())
+
+        filename = f"Profile.{extension(final_buffer.getvalue())}"
+        f = discord.File(filename=filename, fp=final_buffer)
 
-        fn = partial(CardImage(info).imager, self.bot.designs[DEFAULT])
-        final_buffer = await self.bot.loop.run_in_executor(None, fn)
+        embed = discord.utils.MISSING
+        if size != "full":
+            embed = discord.Embed(title=user.display_name, colour=discord.Colour.blurple())
+            if size == "thumbnail":
+                embed.set_thumbnail(url=f"attachment://{filename}")
+            else:
+                embed.set_image(url=f"attachment://{filename}")
 
-        f = discord.File(filename="Profile.png", fp=final_buffer)
+        with METRICS.span("profile_stage_seconds", sampled, stage="upload"):
+            await interaction.followup.send(file=f, embed=embed)
 
-        await interaction.followup.send(file=f)
+        if sampled:
+            METRICS.observe("profile_seconds", time.perf_counter() - start)
 
 
 async def setup(bot):
@@ -0,0 +1,195 @@
+"""Standalone HTTP render service
+
+Renders cards outside the bot process, so render load can be scaled separately from the Discord gateway:
+
+    python render_server.py --port 8710 --backend process --workers 4
+
+POST /render with the JSON body built by Objects.RemoteRender.pack_request returns the encoded card.
+It returns 503 when the render queue is full, and 409 when the request asks for a design version other than the one
+this server has compiled, which happens while an edit is only picked up on one side. GET /health reports the queue
+and cache state. Connections are kept alive between requests. Point RENDER_ENDPOINTS in config.py at one or more of
+these to have the bot render through them.
+"""
+import argparse
+import asyncio
+import json
+from typing import Dict, Optional, Tuple
+
+from Objects.AssetCache import ASSET_CACHE
+from Objects.AvatarCache import AVATAR_CACHE
+from Objects.CardImage import ENGINES
+from Objects.DesignWatcher import DesignWatcher
+from Objects.DiskCache import DiskCache
+from Objects.Encoder import extension
+from Objects.RemoteRender import unpack_request
+from Objects.RenderBackend import RenderBackend, RenderBusy
+from Objects.RenderPlan import DesignStore
+from Objects.RenderScheduler import RenderScheduler
+from Objects.ResultCache import RESULT_CACHE, card_key
+
+MAX_BODY = 16 * 1024 * 1024
+
+CONTENT_TYPES = {"png": "image/png", "webp": "image/webp", "jpg": "image/jpeg", "gif": "image/gif"}
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 409: "Conflict",
+           413: "Payload Too Large", 500: "Internal Server Error", 503: "Service Unavailable"}
+
+
+class RequestTooLarge(Exception):
+    pass
+
+
+class RenderServer:
+    def __init__(self, store: DesignStore, scheduler: RenderScheduler, watcher: DesignWatcher, *,
+                 idle_timeout: float = 30):
+        self.store: DesignStore = store
+        self.scheduler: RenderScheduler = scheduler
+        self.watcher: DesignWatcher = watcher
+        self.idle_timeout: float = idle_timeout
+
+    async def read_request(self, reader: asyncio.StreamReader) -> Optional[Tuple[str, str, Dict[str, str], bytes]]:
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), self.idle_timeout)
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            return None
+
+        try:
+            lines = head.decode("latin-1").split("\r\n")
+            method, path, _ = lines[0].split(" ", 2)
+            headers = {}
+            for line in lines[1:]:
+                if ":" in line:
+                    k, v = line.split(":", 1)
+                    headers[k.strip().lower()] = v.strip()
+            length = int(headers.get("content-length", 0))
+        except ValueError:
+            return None
+
+        if length > MAX_BODY:
+            raise RequestTooLarge()
+        try:
+            body = await reader.readexactly(length) if length else b""
+        except asyncio.IncompleteReadError:
+            return None
+        return method, path, headers, body
+
+    async def handle(self, method: str, path: str, body: bytes, peer: str) -> Tuple[int, str, bytes]:
+        if path == "/health":
+            data = {"designs": {p.name: p.version for p in self.store.plans.values()},
+                    "design_errors": self.watcher.errors, "scheduler": self.scheduler.stats(),
+                    "asset_cache": ASSET_CACHE.stats(), "result_cache": RESULT_CACHE.stats(),
+                    "disk_cache": RESULT_CACHE.disk.stats() if RESULT_CACHE.disk else None}
+            return 200, "application/json", json.dumps(data).encode()
+
+        if path != "/render":
+            return 404, "text/plain", b"not found"
+        if method != "POST":
+            return 405, "text/plain", b"use POST"
+
+        try:
+            design, version, mem = unpack_request(body)
+        except (ValueError, KeyError, TypeError) as e:
+            return 400, "text/plain", f"bad request: {e}".encode()
+
+        if design not in self.store:
+            return 404, "text/plain", f"unknown design {design}".encode()
+        plan = self.store[design]
+        if version is not None and version != plan.version:
+            return 409, "text/plain", f"{design} is at version {plan.version}, not {version}".encode()
+
+        key = card_key(plan, mem)
+        data = await RESULT_CACHE.get_card(plan, key)
+        if data is None:
+            try:
+                data = (await self.scheduler.submit(plan, mem, key=key, guild=peer)).getvalue()
+            except RenderBusy:
+                return 503, "text/plain", b"busy"
+            await RESULT_CACHE.put_card(plan, key, data)
+
+        return 200, CONTENT_TYPES[extension(data)], data
+
+    async def connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        peer = writer.get_extra_info("peername")
+        peer = peer[0] if peer else None
+        try:
+            while True:
+                try:
+                    request = await self.read_request(reader)
+                except RequestTooLarge:
+                    await self.respond(writer, 413, "text/plain", b"too large", False)
+                    break
+                if request is None:
+                    break
+
+                method, path, headers, body = request
+                keep_alive = headers.get("connection", "").lower() != "close"
+                try:
+                    status, kind, data = await self.handle(method, path, body, peer)
+                except Exception as e:
+                    status, kind, data = 500, "text/plain", f"{type(e).__name__}: {e}".encode()
+
+                await self.respond(writer, status, kind, data, keep_alive)
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def respond(writer: asyncio.StreamWriter, status: int, kind: str, data: bytes, keep_alive: bool):
+        writer.write(f"HTTP/1.1 {status} {REASONS[status]}\r\nContent-Type: {kind}\r\nContent-Length: {len(data)}\r\n"
+                     f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode() + data)
+        await writer.drain()
+
+
+async def serve(args):
+    store = DesignStore(args.designs, "Designs")
+    store.load_all()
+
+    disk_cache = DiskCache(args.disk_cache, args.disk_cache_mb * 1024 * 1024) if args.disk_cache else None
+    RESULT_CACHE.disk = disk_cache
+    AVATAR_CACHE.disk = disk_cache
+
+    backend = RenderBackend(args.backend, workers=args.workers, engine=args.engine, disk_cache=disk_cache)
+    backend.start(store)
+    scheduler = RenderScheduler(backend, max_queue=args.queue)
+    scheduler.start()
+
+    watcher = DesignWatcher(store, interval=args.watch, engine=args.engine)
+    watcher.start()
+
+    server = RenderServer(store, scheduler, watcher)
+    tcp = await asyncio.start_server(server.connection, args.host, args.port)
+    print(f"Rendering {', '.join(store.plans)} on http://{args.host}:{args.port} "
+          f"({args.backend}, {backend.workers} workers)")
+    try:
+        async with tcp:
+            await tcp.serve_forever()
+    finally:
+        await watcher.stop()
+        await scheduler.stop()
+        backend.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve profile card renders over HTTP")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8710)
+    parser.add_argument("--designs", nargs="+", default=["default", "test"], help="design files in Designs/")
+    parser.add_argument("--backend", default="process", choices=RenderBackend.KINDS)
+    parser.add_argument("--workers", type=int, default=None, help="defaults to the number of CPUs")
+    parser.add_argument("--engine", default="pil", choices=ENGINES)
+    parser.add_argument("--watch", type=float, default=1.0, help="seconds between checks for design edits")
+    parser.add_argument("--queue", type=int, default=64, help="queued renders before answering 503")
+    parser.add_argument("--disk-cache", default=None, help="folder to keep cards and avatars in across restarts")
+    parser.add_argument("--disk-cache-mb", type=int, default=1024)
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
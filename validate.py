@@ -0,0 +1,61 @@
+"""Checks designs before they are deployed
+
+Validates each design's JSON against the schema load_design_from_json expects, checks that its groups, fonts,
+colours, images, masks and role keys exist, compiles it, and checks every group has enough queue slots for the most
+items it can show. It then estimates the cost of the most expensive card the design can render: the one for a member
+holding every role that shows more, with the longest possible names and a 1024px avatar.
+
+    python validate.py default test
+    python validate.py default --max-ms 40 --max-mb 64
+
+Exits with status 1 when a design has errors or goes over a budget. No Discord connection or config.py is needed.
+"""
+import argparse
+import json
+import sys
+
+from Objects.CardImage import ENGINES
+from Objects.DesignCheck import check_design
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Validate designs and estimate their worst case render cost")
+    parser.add_argument("designs", nargs="+", help="design files in Designs/, without .json")
+    parser.add_argument("--max-ms", type=float, default=None, help="budget for a render with warm caches")
+    parser.add_argument("--max-cold-ms", type=float, default=None, help="budget for a render with empty caches")
+    parser.add_argument("--max-mb", type=float, default=None, help="budget for decoded assets and cached layers")
+    parser.add_argument("--no-render", action="store_true", help="only estimate, without timing renders")
+    parser.add_argument("--engine", default="pil", choices=ENGINES)
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+    if args.no_render and (args.max_ms is not None or args.max_cold_ms is not None):
+        parser.error("--max-ms and --max-cold-ms need timed renders, drop --no-render to check them")
+
+    results = {}
+    failed = False
+    for name in args.designs:
+        report = check_design(f"Designs/{name}.json", "Designs", timed=not args.no_render, engine=args.engine)
+        over = report.over_budget(args.max_ms, args.max_cold_ms, args.max_mb) if report.ok else []
+        failed |= bool(report.errors or over)
+        results[name] = {"errors": report.errors, "over_budget": over, "cost": report.cost}
+
+        if args.json:
+            continue
+        print(f"{report.file_path}: {'ok' if report.ok and not over else 'FAILED'}")
+        for e in report.errors + over:
+            print(f"  {e}")
+        if report.cost:
+            c = report.cost
+            print(f"  worst case: {c['pastes']} pastes over {c['area'] / 1e6:.2f} Mpx cold, {c['warm_pastes']} over "
+                  f"{c['warm_area'] / 1e6:.2f} Mpx warm, {c['font_sizes']} font sizes, "
+                  f"{c['memory'] / 1024 / 1024:.1f} MB cached")
+            if "warm_ms" in c:
+                print(f"  rendered in {c['cold_ms']:.1f} ms cold, {c['warm_ms']:.1f} ms warm")
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()